@@ -1,8 +1,9 @@
 from discord.ext import commands
+from discord.ext.commands.view import StringView
 from .utils.chat_formatting import box
 from .utils.dataIO import dataIO
 from .utils import checks
-from __main__ import user_allowed, send_cmd_help
+from __main__ import send_cmd_help
 from copy import copy
 import os
 import discord
@@ -14,6 +15,16 @@ class Alias:
         self.file_path = "data/alias/aliases.json"
         self.aliases = dataIO.load_json(self.file_path)
         self.remove_old()
+        self._resolved = {sid: {} for sid in self.aliases}
+        for sid, aliases in self.aliases.items():
+            for alias, to_execute in aliases.items():
+                self.resolve(sid, alias, to_execute)
+        bot.add_message_handler(self.check_alias, commands_only=True,
+                                server_only=True,
+                                check=lambda m: m.server.id in self.aliases)
+
+    def __unload(self):
+        self.bot.remove_message_handler(self.check_alias)
 
     @commands.group(pass_context=True, no_pm=True)
     async def alias(self, ctx):
@@ -45,6 +56,7 @@ class Alias:
             self.aliases[server.id] = {}
         if command not in self.bot.commands:
             self.aliases[server.id][command] = to_execute
+            self.resolve(server.id, command, to_execute)
             dataIO.save_json(self.file_path, self.aliases)
             await self.bot.say("Alias '{}' added.".format(command))
         else:
@@ -88,6 +100,7 @@ class Alias:
         server = ctx.message.server
         if server.id in self.aliases:
             self.aliases[server.id].pop(command, None)
+            self._resolved.get(server.id, {}).pop(command, None)
             dataIO.save_json(self.file_path, self.aliases)
         await self.bot.say("Alias '{}' deleted.".format(command))
 
@@ -110,25 +123,48 @@ class Alias:
             else:
                 await self.bot.say("There are no aliases on this server.")
 
-    async def on_message(self, message):
-        if len(message.content) < 2 or message.channel.is_private:
+    async def check_alias(self, message, info):
+        if len(message.content) < 2 or not info.prefix:
             return
 
         msg = message.content
         server = message.server
-        prefix = self.get_prefix(server, msg)
+        prefix = info.prefix
 
-        if not prefix:
+        alias = self.first_word(msg[len(prefix):]).lower()
+        resolved = self._resolved.get(server.id, {}).get(alias)
+        if resolved is None:
+            return
+        name, template = resolved
+        command = self.bot.commands.get(name)
+        if command is None:
             return
+        args = template + msg[len(prefix + alias):]
+        new_message = copy(message)
+        new_message.content = prefix + name + args
+        await self.invoke_alias(command, name, prefix, args, new_message)
+
+    async def invoke_alias(self, command, name, prefix, args, message):
+        """Invokes the aliased command as process_commands would
+
+        The arguments are known at this point, so there's no need to
+        parse the expanded message again"""
+        ctx = commands.Context(bot=self.bot, message=message,
+                               view=StringView(args), prefix=prefix,
+                               invoked_with=name)
+        self.bot.dispatch('command', command, ctx)
+        try:
+            await command.invoke(ctx)
+        except commands.CommandError as e:
+            ctx.command.dispatch_error(e, ctx)
+        else:
+            self.bot.dispatch('command_completion', command, ctx)
 
-        if server.id in self.aliases and user_allowed(message):
-            alias = self.first_word(msg[len(prefix):]).lower()
-            if alias in self.aliases[server.id]:
-                new_command = self.aliases[server.id][alias]
-                args = message.content[len(prefix + alias):]
-                new_message = copy(message)
-                new_message.content = prefix + new_command + args
-                await self.bot.process_commands(new_message)
+    def resolve(self, sid, alias, to_execute):
+        """Stores the command name and arguments the alias expands to"""
+        name = self.first_word(to_execute)
+        template = to_execute[len(name):]
+        self._resolved.setdefault(sid, {})[alias.lower()] = (name, template)
 
     def part_of_existing_command(self, alias, server):
         '''Command or alias'''
@@ -163,11 +199,7 @@ class Alias:
         return msg.split(" ")[0]
 
     def get_prefix(self, server, msg):
-        prefixes = self.bot.settings.get_prefixes(server)
-        for p in prefixes:
-            if msg.startswith(p):
-                return p
-        return None
+        return self.bot.settings.match_prefix(server, msg)
 
 
 def check_folder():
@@ -230,7 +230,7 @@ class Playlist:
             self.save()
 
     def save(self):
-        dataIO.save_json(self.path, self.to_json())
+        dataIO.save_json_async(self.path, self.to_json())
 
     @property
     def sid(self):
@@ -728,7 +728,7 @@ class Audio:
             new_playlists = []
         return list(set(old_playlists + new_playlists))
 
-    def _load_playlist(self, server, name, local=True):
+    async def _load_playlist(self, server, name, local=True):
         try:
             server = server.id
         except:
@@ -739,7 +739,7 @@ class Audio:
             f = os.path.join(f, server, name + ".txt")
         else:
             f = os.path.join(f, name + ".txt")
-        kwargs = dataIO.load_json(f)
+        kwargs = await dataIO.load_json_async(f)
 
         kwargs['path'] = f
         kwargs['main_class'] = self
@@ -992,7 +992,7 @@ class Audio:
             log.debug('Bot status returned to ' + str(self._old_game))
             self._old_game = False
 
-    def _save_playlist(self, server, name, playlist):
+    async def _save_playlist(self, server, name, playlist):
         sid = server.id
         try:
             f = playlist.filename
@@ -1007,7 +1007,7 @@ class Audio:
 
         log.debug("saving playlist '{}' to {}:\n\t{}".format(name, f,
                                                              playlist))
-        dataIO.save_json(f, playlist)
+        await dataIO.save_json_async(f, playlist)
 
     def _shuffle_queue(self, server):
         shuffle(self.queue[server.id][QueueKey.QUEUE])
@@ -1542,7 +1542,7 @@ class Audio:
         playlist.name = name
         playlist.server = server
 
-        self._save_playlist(server, name, playlist)
+        await self._save_playlist(server, name, playlist)
         await self.bot.say("Empty playlist '{}' saved.".format(name))
 
     @playlist.command(pass_context=True, no_pm=True, name="add")
@@ -1574,7 +1574,7 @@ class Audio:
             playlist.name = name
             playlist.server = server
 
-            self._save_playlist(server, name, playlist)
+            await self._save_playlist(server, name, playlist)
             await self.bot.say("Playlist '{}' saved. Tracks: {}".format(
                 name, len(songlist)))
         else:
@@ -1591,7 +1591,7 @@ class Audio:
         if name not in self._list_playlists(server):
             await self.bot.say("There is no playlist with that name.")
             return
-        playlist = self._load_playlist(
+        playlist = await self._load_playlist(
             server, name, local=self._playlist_exists_local(server, name))
         try:
             playlist.append_song(author, url)
@@ -1653,7 +1653,7 @@ class Audio:
             await self.bot.say("Playlist not found.")
             return
 
-        playlist = self._load_playlist(
+        playlist = await self._load_playlist(
             server, name, local=self._playlist_exists_local(server, name))
 
         if not playlist.can_edit(author):
@@ -1700,7 +1700,7 @@ class Audio:
                 else:
                     await self._join_voice_channel(voice_channel)
             self._clear_queue(server)
-            playlist = self._load_playlist(server, name,
+            playlist = await self._load_playlist(server, name,
                                            local=self._playlist_exists_local(
                                                server, name))
             if caller == "playlist_start_mix":
@@ -2239,7 +2239,7 @@ class Audio:
                 pass
 
     def save_settings(self):
-        dataIO.save_json('data/audio/settings.json', self.settings)
+        dataIO.save_json_async('data/audio/settings.json', self.settings)
 
     def set_server_setting(self, server, key, value):
         if server.id not in self.settings["SERVERS"]:
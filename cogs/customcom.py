@@ -6,6 +6,70 @@ import os
 import re
 
 
+PLACEHOLDER = re.compile(r"\{([^}]+)\}")
+INNER_PLACEHOLDER = re.compile(r"\{([^{}]+)\}")
+# For security reasons only specific objects are allowed
+TEMPLATE_OBJECTS = {
+    "message" : lambda m: m,
+    "author"  : lambda m: m.author,
+    "channel" : lambda m: m.channel,
+    "server"  : lambda m: m.server
+}
+
+
+class CCTemplate:
+    """A custom command's text, split into static text and placeholders
+
+    Rendering joins the static parts with the placeholders' values.
+    Like the str.replace loop it replaces, a placeholder found by
+    PLACEHOLDER is substituted wherever it appears, even right after
+    a stray {"""
+
+    __slots__ = ("text", "_parts")
+
+    def __init__(self, text):
+        self.text = text
+        names = set(PLACEHOLDER.findall(text))
+        parts = []
+        pos = 0
+        for match in INNER_PLACEHOLDER.finditer(text):
+            if match.group(1) not in names:
+                continue
+            parts.append(text[pos:match.start()])
+            parts.append(self._compile(match.group(1)))
+            pos = match.end()
+        parts.append(text[pos:])
+        self._parts = []
+        for part in parts:  # Merges consecutive static parts
+            if isinstance(part, str) and self._parts and \
+                    isinstance(self._parts[-1], str):
+                self._parts[-1] += part
+            elif part != "":
+                self._parts.append(part)
+
+    def render(self, message):
+        return "".join(p if isinstance(p, str) else p(message)
+                       for p in self._parts)
+
+    @staticmethod
+    def _compile(result):
+        """Returns a getter for the placeholder, or its raw text if invalid
+
+        Internals are ignored"""
+        raw_result = "{" + result + "}"
+        if result in TEMPLATE_OBJECTS:
+            get_object = TEMPLATE_OBJECTS[result]
+            return lambda m: str(get_object(m))
+        try:
+            first, second = result.split(".")
+        except ValueError:
+            return raw_result
+        if first not in TEMPLATE_OBJECTS or second.startswith("_"):
+            return raw_result
+        get_object = TEMPLATE_OBJECTS[first]
+        return lambda m: str(getattr(get_object(m), second, raw_result))
+
+
 class CustomCommands:
     """Custom commands
 
@@ -15,6 +79,16 @@ class CustomCommands:
         self.bot = bot
         self.file_path = "data/customcom/commands.json"
         self.c_commands = dataIO.load_json(self.file_path)
+        self._resolved = {}
+        for sid, cmdlist in self.c_commands.items():
+            for command, text in cmdlist.items():
+                self.resolve(sid, command, text)
+        bot.add_message_handler(self.check_custom_command,
+                                commands_only=True, server_only=True,
+                                check=lambda m: m.server.id in self.c_commands)
+
+    def __unload(self):
+        self.bot.remove_message_handler(self.check_custom_command)
 
     @commands.group(aliases=["cc"], pass_context=True, no_pm=True)
     async def customcom(self, ctx):
@@ -44,6 +118,7 @@ class CustomCommands:
         if command not in cmdlist:
             cmdlist[command] = text
             self.c_commands[server.id] = cmdlist
+            self.resolve(server.id, command, text)
             dataIO.save_json(self.file_path, self.c_commands)
             await self.bot.say("Custom command successfully added.")
         else:
@@ -66,6 +141,7 @@ class CustomCommands:
             if command in cmdlist:
                 cmdlist[command] = text
                 self.c_commands[server.id] = cmdlist
+                self.resolve(server.id, command, text)
                 dataIO.save_json(self.file_path, self.c_commands)
                 await self.bot.say("Custom command successfully edited.")
             else:
@@ -91,6 +167,11 @@ class CustomCommands:
             if command in cmdlist:
                 cmdlist.pop(command, None)
                 self.c_commands[server.id] = cmdlist
+                self._resolved.get(server.id, {}).pop(command, None)
+                # Legacy mixed case names can still be triggered
+                for name, text in cmdlist.items():
+                    if name.lower() == command:
+                        self.resolve(server.id, name, text)
                 dataIO.save_json(self.file_path, self.c_commands)
                 await self.bot.say("Custom command successfully deleted.")
             else:
@@ -121,64 +202,27 @@ class CustomCommands:
             for page in pagify(commands, delims=[" ", "\n"]):
                 await self.bot.whisper(box(page))
 
-    async def on_message(self, message):
-        if len(message.content) < 2 or message.channel.is_private:
+    async def check_custom_command(self, message, info):
+        if len(message.content) < 2 or not info.prefix:
             return
 
         server = message.server
-        prefix = self.get_prefix(message)
-
-        if not prefix:
-            return
-
-        if server.id in self.c_commands and self.bot.user_allowed(message):
-            cmdlist = self.c_commands[server.id]
-            cmd = message.content[len(prefix):]
-            if cmd in cmdlist:
-                cmd = cmdlist[cmd]
-                cmd = self.format_cc(cmd, message)
-                await self.bot.send_message(message.channel, cmd)
-            elif cmd.lower() in cmdlist:
-                cmd = cmdlist[cmd.lower()]
-                cmd = self.format_cc(cmd, message)
-                await self.bot.send_message(message.channel, cmd)
-
-    def get_prefix(self, message):
-        for p in self.bot.settings.get_prefixes(message.server):
-            if message.content.startswith(p):
-                return p
-        return False
-
-    def format_cc(self, command, message):
-        results = re.findall("\{([^}]+)\}", command)
-        for result in results:
-            param = self.transform_parameter(result, message)
-            command = command.replace("{" + result + "}", param)
-        return command
-
-    def transform_parameter(self, result, message):
-        """
-        For security reasons only specific objects are allowed
-        Internals are ignored
-        """
-        raw_result = "{" + result + "}"
-        objects = {
-            "message" : message,
-            "author"  : message.author,
-            "channel" : message.channel,
-            "server"  : message.server
-        }
-        if result in objects:
-            return str(objects[result])
-        try:
-            first, second = result.split(".")
-        except ValueError:
-            return raw_result
-        if first in objects and not second.startswith("_"):
-            first = objects[first]
-        else:
-            return raw_result
-        return str(getattr(first, second, raw_result))
+        prefix = info.prefix
+
+        cmd = message.content[len(prefix):].lower()
+        template = self._resolved.get(server.id, {}).get(cmd)
+        if template is not None:
+            cmd = template.render(message)
+            await self.bot.send_message(message.channel, cmd)
+
+    def resolve(self, sid, command, text):
+        """Maps the lowercased command name to its compiled response"""
+        resolved = self._resolved.setdefault(sid, {})
+        key = command.lower()
+        # Names saved before they were lowercased shouldn't shadow
+        # the lowercase ones
+        if key == command or key not in resolved:
+            resolved[key] = CCTemplate(text)
 
 
 def check_folders():
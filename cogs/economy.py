@@ -1,17 +1,20 @@
 import discord
 from discord.ext import commands
 from cogs.utils.dataIO import dataIO
-from collections import namedtuple, defaultdict, deque
+from cogs.utils.sqlstore import SQLiteStore
+from collections import defaultdict, deque
 from datetime import datetime
-from copy import deepcopy
 from .utils import checks
 from cogs.utils.chat_formatting import pagify, box
 from enum import Enum
 from __main__ import send_cmd_help
+from bisect import bisect_left, insort
 import os
+import json
 import time
 import logging
 import random
+import re
 
 default_settings = {"PAYDAY_TIME": 300, "PAYDAY_CREDITS": 120,
                     "SLOT_MIN": 5, "SLOT_MAX": 100, "SLOT_TIME": 0,
@@ -54,6 +57,8 @@ class SameSenderAndReceiver(BankError):
     pass
 
 
+BULK_PROGRESS_THRESHOLD = 10000
+
 NUM_ENC = "\N{COMBINING ENCLOSING KEYCAP}"
 
 
@@ -110,11 +115,313 @@ SLOT_PAYOUTS_MSG = ("Slot machine payouts:\n"
                     "Two symbols: Bet * 2".format(**SMReel.__dict__))
 
 
+_UNRESOLVED = object()
+
+
+class Account:
+    """Read-only view of a bank account
+
+    member and created_at are only resolved / parsed when accessed"""
+
+    __slots__ = ("id", "server", "name", "balance", "_created_at",
+                 "_member")
+
+    def __init__(self, user_id, server, account, member=_UNRESOLVED):
+        _set = object.__setattr__
+        _set(self, "id", user_id)
+        _set(self, "server", server)
+        _set(self, "name", account["name"])
+        _set(self, "balance", account["balance"])
+        _set(self, "_created_at", account["created_at"])
+        _set(self, "_member", member)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Account objects are read-only")
+
+    @property
+    def member(self):
+        if self._member is _UNRESOLVED:
+            object.__setattr__(self, "_member",
+                               self.server.get_member(self.id))
+        return self._member
+
+    @property
+    def created_at(self):
+        if isinstance(self._created_at, str):
+            created_at = datetime.strptime(self._created_at,
+                                           "%Y-%m-%d %H:%M:%S")
+            object.__setattr__(self, "_created_at", created_at)
+        return self._created_at
+
+    def __repr__(self):
+        return ("<Account id={0.id} server={0.server.id} balance={0.balance}>"
+                "".format(self))
+
+
+class BankTransaction:
+    """Stages balance changes across any number of accounts
+
+    Every change is validated against the staged balances as it's
+    made. On commit they are applied together and written to the
+    journal as a single record. Used as a context manager it commits
+    only if the block exits without errors:
+
+        with bank.transaction() as txn:
+            txn.withdraw_credits(sender, 10)
+            txn.deposit_credits(receiver, 10)"""
+
+    def __init__(self, bank):
+        self.bank = bank
+        self._staged = {}  # (server_id, user_id): new balance
+        self._committed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+
+    def get_balance(self, user):
+        return self._get_balance(user.server.id, user.id)
+
+    def withdraw_credits(self, user, amount):
+        self._withdraw(user.server.id, user.id, amount)
+
+    def deposit_credits(self, user, amount):
+        self._deposit(user.server.id, user.id, amount)
+
+    def set_credits(self, user, amount):
+        self._set(user.server.id, user.id, amount)
+
+    def bulk(self, server_id, user_ids, operation, amount):
+        """Stages operation for each listed user that has an account
+
+        operation is deposit, withdraw or set. Withdrawals take at most
+        the available balance instead of failing.
+        Returns the number of staged accounts"""
+        if amount < 0:
+            raise NegativeValue()
+        if operation not in ("deposit", "withdraw", "set"):
+            raise ValueError("Unknown operation: {}".format(operation))
+        server_accounts = self.bank.accounts.get(server_id, {})
+        staged = 0
+        for user_id in set(user_ids):
+            if user_id not in server_accounts:
+                continue
+            balance = self._get_balance(server_id, user_id)
+            if operation == "deposit":
+                balance += amount
+            elif operation == "withdraw":
+                balance = max(balance - amount, 0)
+            else:
+                balance = amount
+            self._staged[(server_id, user_id)] = balance
+            staged += 1
+        return staged
+
+    def commit(self):
+        if self._committed:
+            raise RuntimeError("Transaction already committed")
+        self._committed = True
+        if not self._staged:
+            return
+        accounts = self.bank.accounts
+        ops = []
+        for (server_id, user_id), balance in self._staged.items():
+            accounts[server_id][user_id]["balance"] = balance
+            ops.append(["set", server_id, user_id, balance])
+        self.bank._log(*ops)
+
+    def _get_balance(self, server_id, user_id):
+        key = (server_id, user_id)
+        if key in self._staged:
+            return self._staged[key]
+        try:
+            return self.bank.accounts[server_id][user_id]["balance"]
+        except KeyError:
+            raise NoAccount()
+
+    def _withdraw(self, server_id, user_id, amount):
+        if amount < 0:
+            raise NegativeValue()
+        balance = self._get_balance(server_id, user_id)
+        if balance < amount:
+            raise InsufficientBalance()
+        self._staged[(server_id, user_id)] = balance - amount
+
+    def _deposit(self, server_id, user_id, amount):
+        if amount < 0:
+            raise NegativeValue()
+        balance = self._get_balance(server_id, user_id)
+        self._staged[(server_id, user_id)] = balance + amount
+
+    def _set(self, server_id, user_id, amount):
+        if amount < 0:
+            raise NegativeValue()
+        self._get_balance(server_id, user_id)  # Account must exist
+        self._staged[(server_id, user_id)] = amount
+
+
+class BalanceIndex:
+    """Keeps keys sorted by balance, highest first
+
+    Updates are a binary search plus a list insertion, reading the
+    top entries doesn't involve any sorting"""
+
+    def __init__(self):
+        self._entries = []  # (-balance, key)
+        self._balances = {}
+
+    def update(self, key, balance):
+        old = self._balances.get(key)
+        if old is not None:
+            if old == balance:
+                return
+            del self._entries[bisect_left(self._entries, (-old, key))]
+        self._balances[key] = balance
+        insort(self._entries, (-balance, key))
+
+    def update_many(self, items):
+        """Updates several keys, resorting once if there are many"""
+        items = list(items)
+        if len(items) * 8 < len(self._entries):
+            for key, balance in items:
+                self.update(key, balance)
+            return
+        self._balances.update(items)
+        self._entries = sorted((-b, k) for k, b in self._balances.items())
+
+    def remove(self, key):
+        old = self._balances.pop(key, None)
+        if old is not None:
+            del self._entries[bisect_left(self._entries, (-old, key))]
+
+    def __iter__(self):
+        """Yields (key, balance), highest balance first"""
+        for balance, key in self._entries:
+            yield key, -balance
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class BankJournal:
+    """Append-only log of the bank's balance mutations
+
+    Each line is a list of operations applied together. Operations
+    store the resulting state rather than a delta, so replaying one
+    that is already part of the snapshot is harmless"""
+
+    def __init__(self, path, *, compact_every=1000):
+        self.path = path
+        self.old_path = path + ".old"
+        self.compact_every = compact_every
+        self.records = 0
+        self._file = None
+
+    def append(self, *ops):
+        if self._file is None:
+            self._file = open(self.path, encoding="utf-8", mode="a")
+        self._file.write(json.dumps(ops) + "\n")
+        self._file.flush()
+        self.records += 1
+        return self.records >= self.compact_every
+
+    def replay(self, accounts):
+        """Applies the logged operations to accounts, oldest first
+
+        Returns the number of applied lines"""
+        applied = 0
+        for path in (self.old_path, self.path):
+            try:
+                with open(path, encoding="utf-8", mode="r") as f:
+                    lines = f.readlines()
+            except FileNotFoundError:
+                continue
+            for line in lines:
+                try:
+                    ops = json.loads(line)
+                except ValueError:  # Torn write of the last line
+                    continue
+                for op in ops:
+                    self.apply(accounts, op)
+                applied += 1
+        return applied
+
+    @staticmethod
+    def apply(accounts, op):
+        action, server_id = op[0], op[1]
+        if action == "wipe":
+            accounts[server_id] = {}
+        elif action == "create":
+            accounts.setdefault(server_id, {})[op[2]] = op[3]
+        elif action == "set":
+            try:
+                accounts[server_id][op[2]]["balance"] = op[3]
+            except KeyError:  # Wiped later on, nothing to restore
+                pass
+
+    def rotate(self):
+        """Moves the current log aside before a snapshot is taken
+
+        If a previous snapshot failed its log is kept and the
+        current one is appended to it"""
+        self.close()
+        self.records = 0
+        if not os.path.isfile(self.path):
+            return
+        if os.path.isfile(self.old_path):
+            with open(self.path, encoding="utf-8", mode="r") as f:
+                lines = f.read()
+            with open(self.old_path, encoding="utf-8", mode="a") as f:
+                f.write(lines)
+            os.remove(self.path)
+        else:
+            os.replace(self.path, self.old_path)
+
+    def discard_old(self):
+        try:
+            os.remove(self.old_path)
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
 class Bank:
+    """Accounts of every server
+
+    Stored in bank.json plus a journal of the changes made since, or
+    in the SQLite store if one is passed"""
 
-    def __init__(self, bot, file_path):
-        self.accounts = dataIO.load_json(file_path)
+    def __init__(self, bot, file_path, store=None):
+        dataIO.set_profile(file_path, "compact")
         self.bot = bot
+        self.file_path = file_path
+        self.store = store
+        self.journal = BankJournal(os.path.splitext(file_path)[0] +
+                                   ".journal")
+        self._compacting = False
+        if store is None:
+            self.accounts = self._load_json()
+        else:
+            if not store.is_imported("bank"):
+                print("Moving bank accounts to SQLite...")
+                store.import_bank(self._load_json())
+            self.accounts = store.load_accounts()
+        self._server_index = defaultdict(BalanceIndex)
+        self._global_index = BalanceIndex()
+        ops = []
+        for server_id, accounts in self.accounts.items():
+            if "balance" in accounts:  # Legacy, serverless account
+                continue
+            ops.extend(["set", server_id, user_id, account["balance"]]
+                       for user_id, account in accounts.items())
+        self._update_index(ops)
 
     def create_account(self, user, *, initial_balance=0):
         server = user.server
@@ -131,7 +438,7 @@ class Bank:
                        "created_at": timestamp
                        }
             self.accounts[server.id][user.id] = account
-            self._save_bank()
+            self._log(["create", server.id, user.id, account])
             return self.get_account(user)
         else:
             raise AccountAlreadyExists()
@@ -143,37 +450,47 @@ class Bank:
             return False
         return True
 
-    def withdraw_credits(self, user, amount):
-        server = user.server
+    def transaction(self):
+        return BankTransaction(self)
 
-        if amount < 0:
-            raise NegativeValue()
+    def bulk_deposit(self, server, amount, user_ids=None):
+        """Deposits amount on many accounts with a single write
 
-        account = self._get_account(user)
-        if account["balance"] >= amount:
-            account["balance"] -= amount
-            self.accounts[server.id][user.id] = account
-            self._save_bank()
-        else:
-            raise InsufficientBalance()
+        Defaults to every account of the server.
+        Returns the number of updated accounts"""
+        return self._bulk(server, "deposit", amount, user_ids)
+
+    def bulk_withdraw(self, server, amount, user_ids=None):
+        """Withdraws up to amount from many accounts with a single write
+
+        Defaults to every account of the server.
+        Returns the number of updated accounts"""
+        return self._bulk(server, "withdraw", amount, user_ids)
+
+    def bulk_set(self, server, amount, user_ids=None):
+        """Sets the balance of many accounts with a single write
+
+        Defaults to every account of the server.
+        Returns the number of updated accounts"""
+        return self._bulk(server, "set", amount, user_ids)
+
+    def _bulk(self, server, operation, amount, user_ids):
+        if user_ids is None:
+            user_ids = list(self.accounts.get(server.id, {}))
+        with self.transaction() as txn:
+            return txn.bulk(server.id, user_ids, operation, amount)
+
+    def withdraw_credits(self, user, amount):
+        with self.transaction() as txn:
+            txn.withdraw_credits(user, amount)
 
     def deposit_credits(self, user, amount):
-        server = user.server
-        if amount < 0:
-            raise NegativeValue()
-        account = self._get_account(user)
-        account["balance"] += amount
-        self.accounts[server.id][user.id] = account
-        self._save_bank()
+        with self.transaction() as txn:
+            txn.deposit_credits(user, amount)
 
     def set_credits(self, user, amount):
-        server = user.server
-        if amount < 0:
-            raise NegativeValue()
-        account = self._get_account(user)
-        account["balance"] = amount
-        self.accounts[server.id][user.id] = account
-        self._save_bank()
+        with self.transaction() as txn:
+            txn.set_credits(user, amount)
 
     def transfer_credits(self, sender, receiver, amount):
         if amount < 0:
@@ -181,11 +498,9 @@ class Bank:
         if sender is receiver:
             raise SameSenderAndReceiver()
         if self.account_exists(sender) and self.account_exists(receiver):
-            sender_acc = self._get_account(sender)
-            if sender_acc["balance"] < amount:
-                raise InsufficientBalance()
-            self.withdraw_credits(sender, amount)
-            self.deposit_credits(receiver, amount)
+            with self.transaction() as txn:
+                txn.withdraw_credits(sender, amount)
+                txn.deposit_credits(receiver, amount)
         else:
             raise NoAccount()
 
@@ -198,18 +513,12 @@ class Bank:
 
     def wipe_bank(self, server):
         self.accounts[server.id] = {}
-        self._save_bank()
+        self._log(["wipe", server.id])
 
     def get_server_accounts(self, server):
         if server.id in self.accounts:
-            raw_server_accounts = deepcopy(self.accounts[server.id])
-            accounts = []
-            for k, v in raw_server_accounts.items():
-                v["id"] = k
-                v["server"] = server
-                acc = self._create_account_obj(v)
-                accounts.append(acc)
-            return accounts
+            return [Account(k, server, v)
+                    for k, v in self.accounts[server.id].items()]
         else:
             return []
 
@@ -221,12 +530,43 @@ class Bank:
                 # Servers that have since been left will be ignored
                 # Same for users_id from the old bank format
                 continue
-            raw_server_accounts = deepcopy(self.accounts[server.id])
-            for k, v in raw_server_accounts.items():
-                v["id"] = k
-                v["server"] = server
-                acc = self._create_account_obj(v)
-                accounts.append(acc)
+            accounts.extend(Account(k, server, v)
+                            for k, v in self.accounts[server.id].items())
+        return accounts
+
+    def get_server_leaderboard(self, server, top):
+        """Returns the top accounts of members still in the server"""
+        accounts = []
+        if server.id not in self._server_index:
+            return accounts
+        for user_id, balance in self._server_index[server.id]:
+            member = server.get_member(user_id)
+            if member is None:  # Left the server
+                continue
+            account = self.accounts[server.id][user_id]
+            accounts.append(Account(user_id, server, account, member))
+            if len(accounts) == top:
+                break
+        return accounts
+
+    def get_global_leaderboard(self, top):
+        """Returns the top accounts across servers, one per user"""
+        accounts = []
+        seen = set()
+        for (server_id, user_id), balance in self._global_index:
+            if user_id in seen:
+                continue
+            server = self.bot.get_server(server_id)
+            if server is None:
+                continue
+            member = server.get_member(user_id)
+            if member is None:
+                continue
+            seen.add(user_id)
+            account = self.accounts[server_id][user_id]
+            accounts.append(Account(user_id, server, account, member))
+            if len(accounts) == top:
+                break
         return accounts
 
     def get_balance(self, user):
@@ -234,26 +574,73 @@ class Bank:
         return account["balance"]
 
     def get_account(self, user):
-        acc = self._get_account(user)
-        acc["id"] = user.id
-        acc["server"] = user.server
-        return self._create_account_obj(acc)
-
-    def _create_account_obj(self, account):
-        account["member"] = account["server"].get_member(account["id"])
-        account["created_at"] = datetime.strptime(account["created_at"],
-                                                  "%Y-%m-%d %H:%M:%S")
-        Account = namedtuple("Account", "id name balance "
-                             "created_at server member")
-        return Account(**account)
-
-    def _save_bank(self):
-        dataIO.save_json("data/economy/bank.json", self.accounts)
+        return Account(user.id, user.server, self._get_account(user))
+
+    async def compact(self):
+        """Folds the journal into the bank.json snapshot"""
+        if self._compacting:
+            return
+        self._compacting = True
+        try:
+            self.journal.rotate()
+            saved = await dataIO.save_json_async(self.file_path,
+                                                 self.accounts)
+            if saved:
+                self.journal.discard_old()
+        finally:
+            self._compacting = False
+
+    def close(self):
+        self.journal.close()
+
+    def _load_json(self):
+        accounts = dataIO.load_json(self.file_path)
+        if self.journal.replay(accounts):
+            self.journal.rotate()
+            if dataIO.save_json(self.file_path, accounts):
+                self.journal.discard_old()
+        return accounts
+
+    def _log(self, *ops):
+        self._update_index(ops)
+        if self.store is not None:
+            self.store.apply_bank_ops(ops)
+        elif self.journal.append(*ops):
+            self.bot.loop.create_task(self.compact())
+
+    def _update_index(self, ops):
+        server_updates = defaultdict(list)
+        global_updates = []
+
+        def apply_updates():
+            for server_id, updates in server_updates.items():
+                self._server_index[server_id].update_many(updates)
+            self._global_index.update_many(global_updates)
+            server_updates.clear()
+            global_updates.clear()
+
+        for op in ops:
+            if op[0] == "wipe":
+                apply_updates()
+                self._unindex_server(op[1])
+                continue
+            balance = op[3]["balance"] if op[0] == "create" else op[3]
+            server_updates[op[1]].append((op[2], balance))
+            global_updates.append(((op[1], op[2]), balance))
+        apply_updates()
+
+    def _unindex_server(self, server_id):
+        index = self._server_index.pop(server_id, None)
+        if index is not None:
+            for user_id, balance in index:
+                self._global_index.remove((server_id, user_id))
 
     def _get_account(self, user):
+        # Returns the stored dict itself: callers must validate
+        # before mutating it
         server = user.server
         try:
-            return deepcopy(self.accounts[server.id][user.id])
+            return self.accounts[server.id][user.id]
         except KeyError:
             raise NoAccount()
 
@@ -280,6 +667,60 @@ class SetParser:
             raise
 
 
+class Cooldowns:
+    """Last use timestamps of a timed command, per server and user
+
+    Entries are dropped once past the server's cooldown, so only
+    users still cooling off are kept in memory and on disk"""
+
+    PRUNE_INTERVAL = 60
+
+    def __init__(self, file_path, get_cooldown):
+        self.file_path = file_path
+        self.get_cooldown = get_cooldown
+        self._entries = defaultdict(dict, dataIO.load_json(file_path))
+        self._last_prune = 0
+        self.prune()
+
+    def remaining(self, server_id, user_id):
+        """Returns the seconds left before the user can use it again"""
+        last = self._entries.get(server_id, {}).get(user_id)
+        if last is None:
+            return 0
+        cooldown = self.get_cooldown(server_id)
+        elapsed = time.time() - last
+        if elapsed >= cooldown or elapsed < 0:
+            del self._entries[server_id][user_id]
+            return 0
+        return max(int(cooldown - elapsed), 1)
+
+    def trigger(self, server_id, user_id):
+        if self.get_cooldown(server_id) <= 0:
+            return
+        now = time.time()
+        self._entries[server_id][user_id] = now
+        if now - self._last_prune >= self.PRUNE_INTERVAL:
+            self.prune()
+        dataIO.save_json_deferred(self.file_path, self._entries)
+
+    def prune(self):
+        """Drops expired entries"""
+        now = time.time()
+        self._last_prune = now
+        for server_id in list(self._entries):
+            users = self._entries[server_id]
+            cooldown = self.get_cooldown(server_id)
+            expired = [u for u, last in users.items()
+                       if not 0 <= now - last < cooldown]
+            for user_id in expired:
+                del users[user_id]
+            if not users:
+                del self._entries[server_id]
+
+    def __len__(self):
+        return sum(len(users) for users in self._entries.values())
+
+
 class Economy:
     """Economy
 
@@ -288,15 +729,29 @@ class Economy:
     def __init__(self, bot):
         global default_settings
         self.bot = bot
-        self.bank = Bank(bot, "data/economy/bank.json")
+        self.store = None
+        if bot.settings.storage == "sqlite":
+            self.store = SQLiteStore()
+        self.bank = Bank(bot, "data/economy/bank.json", self.store)
         self.file_path = "data/economy/settings.json"
         self.settings = dataIO.load_json(self.file_path)
         if "PAYDAY_TIME" in self.settings:  # old format
             default_settings = self.settings
             self.settings = {}
         self.settings = defaultdict(default_settings.copy, self.settings)
-        self.payday_register = defaultdict(dict)
-        self.slot_register = defaultdict(dict)
+        self.payday_register = Cooldowns(
+            "data/economy/payday_cooldowns.json",
+            lambda sid: self.settings[sid]["PAYDAY_TIME"])
+        self.slot_register = Cooldowns(
+            "data/economy/slot_cooldowns.json",
+            lambda sid: self.settings[sid]["SLOT_TIME"])
+
+    def __unload(self):
+        self.bank.close()
+        if self.store is not None:
+            self.store.close()
+        dataIO.flush(self.payday_register.file_path)
+        dataIO.flush(self.slot_register.file_path)
 
     @commands.group(name="bank", pass_context=True)
     async def _bank(self, ctx):
@@ -398,6 +853,85 @@ class Economy:
         except NoAccount:
             await self.bot.say("User has no bank account.")
 
+    @_bank.group(name="bulk", pass_context=True, no_pm=True)
+    @checks.admin_or_permissions(manage_server=True)
+    async def _bulk(self, ctx):
+        """Updates many bank accounts at once
+
+        Target can be 'all', a role, or a list of users / IDs"""
+        if ctx.invoked_subcommand is None or \
+                isinstance(ctx.invoked_subcommand, commands.Group):
+            await send_cmd_help(ctx)
+
+    @_bulk.command(name="credit", pass_context=True)
+    async def bulk_credit(self, ctx, credits: int, *, target: str):
+        """Adds credits to many accounts
+
+        Examples:
+            bank bulk credit 100 all
+            bank bulk credit 50 Event Winners
+            bank bulk credit 26 @Twentysix 96130341705637888"""
+        await self._bulk_operation(ctx, "deposit", credits, target)
+
+    @_bulk.command(name="debit", pass_context=True)
+    async def bulk_debit(self, ctx, credits: int, *, target: str):
+        """Removes credits from many accounts
+
+        Balances that would go below 0 are set to 0 instead."""
+        await self._bulk_operation(ctx, "withdraw", credits, target)
+
+    @_bulk.command(name="set", pass_context=True)
+    async def bulk_set(self, ctx, credits: int, *, target: str):
+        """Sets the credits of many accounts"""
+        await self._bulk_operation(ctx, "set", credits, target)
+
+    async def _bulk_operation(self, ctx, operation, credits, target):
+        server = ctx.message.server
+        author = ctx.message.author
+        if credits < 0:
+            await self.bot.say("The amount can't be negative.")
+            return
+        user_ids = self._bulk_targets(server, target)
+        if user_ids is not None and not user_ids:
+            await self.bot.say("No users matched that target.")
+            return
+
+        progress = None
+        if user_ids is None:
+            count = len(self.bank.accounts.get(server.id, {}))
+        else:
+            count = len(user_ids)
+        if count >= BULK_PROGRESS_THRESHOLD:
+            progress = await self.bot.say("Updating up to {} accounts..."
+                                          "".format(count))
+
+        bulk = {"deposit": self.bank.bulk_deposit,
+                "withdraw": self.bank.bulk_withdraw,
+                "set": self.bank.bulk_set}[operation]
+        updated = bulk(server, credits, user_ids)
+        logger.info("{}({}) bulk {} {} credits on {} accounts of server {}"
+                    "".format(author.name, author.id, operation, credits,
+                              updated, server.id))
+        msg = "Done. {} accounts have been updated.".format(updated)
+        if progress is not None:
+            await self.bot.edit_message(progress, msg)
+        else:
+            await self.bot.say(msg)
+
+    def _bulk_targets(self, server, target):
+        """Returns the targeted user IDs, None meaning every account"""
+        target = target.strip()
+        if target.lower() == "all":
+            return None
+        role_id = re.fullmatch(r"<@&(\d+)>", target)
+        if role_id:
+            role = discord.utils.get(server.roles, id=role_id.group(1))
+        else:
+            role = discord.utils.get(server.roles, name=target)
+        if role is not None:
+            return [m.id for m in server.members if role in m.roles]
+        return re.findall(r"\d{15,}", target)
+
     @_bank.command(pass_context=True, no_pm=True)
     @checks.serverowner_or_permissions(administrator=True)
     async def reset(self, ctx, confirmation: bool=False):
@@ -418,33 +952,20 @@ class Economy:
         server = author.server
         id = author.id
         if self.bank.account_exists(author):
-            if id in self.payday_register[server.id]:
-                seconds = abs(self.payday_register[server.id][
-                              id] - int(time.perf_counter()))
-                if seconds >= self.settings[server.id]["PAYDAY_TIME"]:
-                    self.bank.deposit_credits(author, self.settings[
-                                              server.id]["PAYDAY_CREDITS"])
-                    self.payday_register[server.id][
-                        id] = int(time.perf_counter())
-                    await self.bot.say(
-                        "{} Here, take some credits. Enjoy! (+{}"
-                        " credits!)".format(
-                            author.mention,
-                            str(self.settings[server.id]["PAYDAY_CREDITS"])))
-                else:
-                    dtime = self.display_time(
-                        self.settings[server.id]["PAYDAY_TIME"] - seconds)
-                    await self.bot.say(
-                        "{} Too soon. For your next payday you have to"
-                        " wait {}.".format(author.mention, dtime))
-            else:
-                self.payday_register[server.id][id] = int(time.perf_counter())
+            remaining = self.payday_register.remaining(server.id, id)
+            if not remaining:
                 self.bank.deposit_credits(author, self.settings[
                                           server.id]["PAYDAY_CREDITS"])
+                self.payday_register.trigger(server.id, id)
                 await self.bot.say(
                     "{} Here, take some credits. Enjoy! (+{} credits!)".format(
                         author.mention,
                         str(self.settings[server.id]["PAYDAY_CREDITS"])))
+            else:
+                dtime = self.display_time(remaining)
+                await self.bot.say(
+                    "{} Too soon. For your next payday you have to"
+                    " wait {}.".format(author.mention, dtime))
         else:
             await self.bot.say("{} You need an account to receive credits."
                                " Type `{}bank register` to open one.".format(
@@ -467,12 +988,8 @@ class Economy:
         server = ctx.message.server
         if top < 1:
             top = 10
-        bank_sorted = sorted(self.bank.get_server_accounts(server),
-                             key=lambda x: x.balance, reverse=True)
-        bank_sorted = [a for a in bank_sorted if a.member] #  exclude users who left
-        if len(bank_sorted) < top:
-            top = len(bank_sorted)
-        topten = bank_sorted[:top]
+        topten = self.bank.get_server_leaderboard(server, top)
+        top = len(topten)
         highscore = ""
         place = 1
         for acc in topten:
@@ -493,16 +1010,8 @@ class Economy:
         Defaults to top 10"""
         if top < 1:
             top = 10
-        bank_sorted = sorted(self.bank.get_all_accounts(),
-                             key=lambda x: x.balance, reverse=True)
-        bank_sorted = [a for a in bank_sorted if a.member] #  exclude users who left
-        unique_accounts = []
-        for acc in bank_sorted:
-            if not self.already_in_list(unique_accounts, acc):
-                unique_accounts.append(acc)
-        if len(unique_accounts) < top:
-            top = len(unique_accounts)
-        topten = unique_accounts[:top]
+        topten = self.bank.get_global_leaderboard(top)
+        top = len(topten)
         highscore = ""
         place = 1
         for acc in topten:
@@ -517,12 +1026,6 @@ class Economy:
         else:
             await self.bot.say("There are no accounts in the bank.")
 
-    def already_in_list(self, accounts, user):
-        for acc in accounts:
-            if user.id == acc.id:
-                return True
-        return False
-
     @commands.command()
     async def payouts(self):
         """Shows slot machine payouts"""
@@ -536,12 +1039,9 @@ class Economy:
         settings = self.settings[server.id]
         valid_bid = settings["SLOT_MIN"] <= bid and bid <= settings["SLOT_MAX"]
         slot_time = settings["SLOT_TIME"]
-        last_slot = self.slot_register.get(author.id)
-        now = datetime.utcnow()
         try:
-            if last_slot:
-                if (now - last_slot).seconds < slot_time:
-                    raise OnCooldown()
+            if self.slot_register.remaining(server.id, author.id):
+                raise OnCooldown()
             if not valid_bid:
                 raise InvalidBid()
             if not self.bank.can_spend(author, bid):
@@ -565,7 +1065,7 @@ class Economy:
     async def slot_machine(self, author, bid):
         default_reel = deque(SMReel)
         reels = []
-        self.slot_register[author.id] = datetime.utcnow()
+        self.slot_register.trigger(author.server.id, author.id)
         for i in range(3):
             default_reel.rotate(random.randint(-999, 999)) # weeeeee
             new_reel = deque(default_reel, maxlen=3) # we need only 3 symbols
@@ -597,18 +1097,18 @@ class Economy:
             elif has_two:
                 payout = PAYOUTS["2 symbols"]
 
+        with self.bank.transaction() as txn:
+            then = txn.get_balance(author)
+            txn.withdraw_credits(author, bid)
+            if payout:
+                txn.deposit_credits(author, payout["payout"](bid))
+            now = txn.get_balance(author)
+
         if payout:
-            then = self.bank.get_balance(author)
-            pay = payout["payout"](bid)
-            now = then - bid + pay
-            self.bank.set_credits(author, now)
             await self.bot.say("{}\n{} {}\n\nYour bid: {}\n{} → {}!"
                                "".format(slot, author.mention,
                                          payout["phrase"], bid, then, now))
         else:
-            then = self.bank.get_balance(author)
-            self.bank.withdraw_credits(author, bid)
-            now = then - bid
             await self.bot.say("{}\n{} Nothing!\nYour bid: {}\n{} → {}!"
                                "".format(slot, author.mention, bid, then, now))
 
@@ -632,7 +1132,7 @@ class Economy:
         server = ctx.message.server
         self.settings[server.id]["SLOT_MIN"] = bid
         await self.bot.say("Minimum bid is now {} credits.".format(bid))
-        dataIO.save_json(self.file_path, self.settings)
+        await dataIO.save_json_async(self.file_path, self.settings)
 
     @economyset.command(pass_context=True)
     async def slotmax(self, ctx, bid: int):
@@ -640,7 +1140,7 @@ class Economy:
         server = ctx.message.server
         self.settings[server.id]["SLOT_MAX"] = bid
         await self.bot.say("Maximum bid is now {} credits.".format(bid))
-        dataIO.save_json(self.file_path, self.settings)
+        await dataIO.save_json_async(self.file_path, self.settings)
 
     @economyset.command(pass_context=True)
     async def slottime(self, ctx, seconds: int):
@@ -648,7 +1148,7 @@ class Economy:
         server = ctx.message.server
         self.settings[server.id]["SLOT_TIME"] = seconds
         await self.bot.say("Cooldown is now {} seconds.".format(seconds))
-        dataIO.save_json(self.file_path, self.settings)
+        await dataIO.save_json_async(self.file_path, self.settings)
 
     @economyset.command(pass_context=True)
     async def paydaytime(self, ctx, seconds: int):
@@ -657,7 +1157,7 @@ class Economy:
         self.settings[server.id]["PAYDAY_TIME"] = seconds
         await self.bot.say("Value modified. At least {} seconds must pass "
                            "between each payday.".format(seconds))
-        dataIO.save_json(self.file_path, self.settings)
+        await dataIO.save_json_async(self.file_path, self.settings)
 
     @economyset.command(pass_context=True)
     async def paydaycredits(self, ctx, credits: int):
@@ -666,7 +1166,7 @@ class Economy:
         self.settings[server.id]["PAYDAY_CREDITS"] = credits
         await self.bot.say("Every payday will now give {} credits."
                            "".format(credits))
-        dataIO.save_json(self.file_path, self.settings)
+        await dataIO.save_json_async(self.file_path, self.settings)
 
     @economyset.command(pass_context=True)
     async def registercredits(self, ctx, credits: int):
@@ -677,7 +1177,7 @@ class Economy:
         self.settings[server.id]["REGISTER_CREDITS"] = credits
         await self.bot.say("Registering an account will now give {} credits."
                            "".format(credits))
-        dataIO.save_json(self.file_path, self.settings)
+        await dataIO.save_json_async(self.file_path, self.settings)
 
     # What would I ever do without stackoverflow?
     def display_time(self, seconds, granularity=2):
@@ -719,6 +1219,11 @@ def check_files():
         print("Creating empty bank.json...")
         dataIO.save_json(f, {})
 
+    for f in ("data/economy/payday_cooldowns.json",
+              "data/economy/slot_cooldowns.json"):
+        if not dataIO.is_valid_json(f):
+            dataIO.save_json(f, {})
+
 
 def setup(bot):
     global logger
@@ -43,6 +43,11 @@ class General:
                      "Ask again later", "Better not tell you now", "Cannot predict now", "Concentrate and ask again",
                      "Don't count on it", "My reply is no", "My sources say no", "Outlook not so good", "Very doubtful"]
         self.poll_sessions = []
+        bot.add_message_handler(self.check_poll_votes, bots=True,
+                                check=lambda m: bool(self.poll_sessions))
+
+    def __unload(self):
+        self.bot.remove_message_handler(self.check_poll_votes)
 
     @commands.command(hidden=True)
     async def ping(self):
@@ -365,10 +370,10 @@ class General:
                 return poll
         return False
 
-    async def check_poll_votes(self, message):
-        if message.author.id != self.bot.user.id:
-            if self.getPollByChannel(message):
-                    self.getPollByChannel(message).checkAnswer(message)
+    async def check_poll_votes(self, message, info):
+        poll = self.getPollByChannel(message)
+        if poll:
+            poll.checkAnswer(message)
 
     def fetch_joined_at(self, user, server):
         """Just a special case for someone special :^)"""
@@ -430,5 +435,4 @@ class NewPoll():
 
 def setup(bot):
     n = General(bot)
-    bot.add_listener(n.check_poll_votes, "on_message")
     bot.add_cog(n)
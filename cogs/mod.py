@@ -2,14 +2,19 @@ import discord
 from discord.ext import commands
 from .utils.dataIO import dataIO
 from .utils import checks
+from .utils.sqlstore import SQLiteStore
 from __main__ import send_cmd_help, settings
 from datetime import datetime
 from collections import deque, defaultdict, OrderedDict
 from cogs.utils.chat_formatting import escape_mass_mentions, box, pagify
 import os
 import re
+import json
+import atexit
 import logging
 import asyncio
+import heapq
+import time
 
 
 ACTIONS_REPR = {
@@ -35,6 +40,8 @@ ACTIONS_CASES = {
 default_settings = {
     "ban_mention_spam"  : False,
     "delete_repeats"    : False,
+    "repeat_count"      : 3,
+    "repeat_window"     : 0,
     "mod-log"           : None,
     "respect_hierarchy" : False
 }
@@ -44,6 +51,10 @@ for act, enabled in ACTIONS_CASES.items():
     act = act.lower() + '_cases'
     default_settings[act] = enabled
 
+NAMES_IMPORTED = "data/mod/names/.imported"
+MODLOG_IMPORTED = "data/mod/modlog/.imported"
+UNSENT_CASES = "data/mod/modlog_unsent.json"
+
 
 class ModError(Exception):
     pass
@@ -65,28 +76,790 @@ class NoModLogAccess(ModError):
     pass
 
 
+def trie_pattern(words):
+    """Returns a regex pattern matching any of the words
+
+    Words sharing a prefix share its branch, so matching doesn't
+    have to try each word at every position. The trie is walked
+    without recursion, entries can be thousands of characters long"""
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    built = {}
+    stack = [(trie, False)]
+    while stack:
+        node, children_built = stack.pop()
+        if not children_built:
+            stack.append((node, True))
+            stack.extend((child, False) for char, child in node.items()
+                         if char)
+            continue
+        alternatives = [re.escape(char) + built.pop(id(child))
+                        for char, child in sorted(node.items()) if char]
+        end = "" in node
+        if not alternatives:
+            pattern = ""
+        elif len(alternatives) == 1 and not end:
+            pattern = alternatives[0]
+        else:
+            pattern = "(?:" + "|".join(alternatives) + ")"
+            if end:
+                pattern += "?"
+        built[id(node)] = pattern
+    return built[id(trie)]
+
+
+def compile_literals(words, template="{}"):
+    """Compiles words into a single trie pattern
+
+    Deeply nested tries can still be too much for the regex compiler,
+    those fall back to a plain alternation, longest words first"""
+    try:
+        return re.compile(template.format(trie_pattern(words)))
+    except (RecursionError, re.error, OverflowError):
+        words = sorted(set(words), key=len, reverse=True)
+        pattern = "|".join(re.escape(w) for w in words)
+        return re.compile(template.format(pattern))
+
+
+class WordFilter:
+    """Compiled matcher of a server's filter entries
+
+    Plain entries match anywhere in the message, entries starting with
+    word: only match whole words and regex: entries are regular
+    expressions. All of them are case insensitive"""
+
+    WORD = "word:"
+    REGEX = "regex:"
+
+    def __init__(self, entries):
+        plain = []
+        words = []
+        patterns = []
+        for entry in entries:
+            if entry.startswith(self.REGEX):
+                pattern = entry[len(self.REGEX):]
+                try:
+                    # Compiled one by one, joined patterns could clash
+                    # on group names and numbered backreferences
+                    patterns.append(re.compile(pattern, re.IGNORECASE))
+                except re.error:
+                    logger.warning("Invalid filter regex: {}".format(pattern))
+            elif entry.startswith(self.WORD):
+                if entry[len(self.WORD):]:
+                    words.append(entry[len(self.WORD):].lower())
+            elif entry:
+                plain.append(entry.lower())
+
+        self._literals = []
+        if plain:
+            self._literals.append(compile_literals(plain))
+        if words:
+            self._literals.append(
+                compile_literals(words, r"(?<!\w)(?:{})(?!\w)"))
+        self._patterns = patterns
+
+    def search(self, content):
+        """Returns the first filtered text found in content, or None"""
+        lowered = content.lower()
+        for literals in self._literals:
+            match = literals.search(lowered)
+            if match:
+                return match.group()
+        for pattern in self._patterns:
+            match = pattern.search(content)
+            if match:
+                return match.group()
+        return None
+
+
+class RepeatDetector:
+    """Detects authors sending the same message several times in a row
+
+    Only a hash of each author's last message and the times it was
+    sent in a row are kept, for at most max_size authors seen in the
+    last expiry seconds"""
+
+    def __init__(self, max_size=100000, expiry=3600):
+        self.max_size = max_size
+        self.expiry = expiry
+        self._entries = OrderedDict()
+
+    def check(self, server_id, author_id, content, repeats, window=0):
+        """Records the message
+
+        Returns True if it's the repeats-th identical message in a row
+        sent within window seconds. 0 means no window other than the
+        expiry"""
+        now = time.monotonic()
+        self._expire(now)
+        key = (server_id, author_id)
+        digest = hash(content)
+        entry = self._entries.pop(key, None)
+        if entry is None or entry[0] != digest or entry[1].maxlen != repeats:
+            entry = (digest, deque(maxlen=repeats))
+        times = entry[1]
+        times.append(now)
+        self._entries[key] = entry
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)  # Least recently active
+        if len(times) < repeats:
+            return False
+        return not window or now - times[0] <= window
+
+    def _expire(self, now):
+        entries = self._entries
+        while entries:
+            times = next(iter(entries.values()))[1]
+            if now - times[-1] < self.expiry:
+                break
+            entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
 class TempCache:
     """
     This is how we avoid events such as ban and unban
     from triggering twice in the mod-log.
     Kinda hacky but functioning
+
+    Entries are dropped by a single task going through an
+    expiry heap, which only runs while the cache isn't empty
     """
     def __init__(self, bot):
         self.bot = bot
-        self._cache = []
+        self._cache = {}
+        self._expiry = []
+        self._task = None
 
     def add(self, user, server, action, seconds=1):
         tmp = (user.id, server.id, action)
-        self._cache.append(tmp)
+        expires = self.bot.loop.time() + seconds
+        if expires > self._cache.get(tmp, 0):
+            self._cache[tmp] = expires
+        heapq.heappush(self._expiry, (expires, tmp))
+        if self._task is None or self._task.done():
+            self._task = self.bot.loop.create_task(self._expire())
+
+    def check(self, user, server, action):
+        expires = self._cache.get((user.id, server.id, action))
+        return expires is not None and expires > self.bot.loop.time()
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _expire(self):
+        while self._expiry:
+            expires, tmp = self._expiry[0]
+            delay = expires - self.bot.loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            heapq.heappop(self._expiry)
+            if self._cache.get(tmp) == expires:
+                del self._cache[tmp]
+
+
+class NameHistory:
+    """Past usernames and nicknames of users
+
+    Stored in shards of append-only json lines: usernames bucketed by
+    user ID, nicknames by server. Shards are loaded on first use, new
+    names are appended in batches every FLUSH_INTERVAL seconds and a
+    shard is rewritten once most of its lines are outdated"""
+
+    MAX_NAMES = 20
+    NAME_BUCKETS = 64
+    FLUSH_INTERVAL = 10
+
+    def __init__(self, path, *, loop=None):
+        self.path = path
+        self.loop = loop or asyncio.get_event_loop()
+        self._shards = {}
+        self._lines = {}
+        self._pending = defaultdict(list)
+        self._flush_handle = None
+        os.makedirs(path, exist_ok=True)
+        atexit.register(self.flush)
+
+    async def get_names(self, user_id):
+        shard = self._load(self._names_shard(user_id))
+        return list(shard.get(user_id, ()))
+
+    async def get_nicknames(self, server_id, user_id):
+        shard = self._load("nicks_" + server_id)
+        return list(shard.get(user_id, ()))
+
+    def add_name(self, user_id, name):
+        """Returns False if the name was already recorded"""
+        return self._add(self._names_shard(user_id), user_id, name)
+
+    def add_nickname(self, server_id, user_id, nick):
+        """Returns False if the nickname was already recorded"""
+        return self._add("nicks_" + server_id, user_id, nick)
+
+    def import_json(self, past_names, past_nicknames):
+        """Imports the old past_names and past_nicknames data
+
+        Shards are written whole, users already found in theirs were
+        imported by an earlier, interrupted run and are skipped"""
+        for user_id, names in past_names.items():
+            if user_id in self._load(self._names_shard(user_id)):
+                continue
+            for name in names:
+                self.add_name(user_id, name)
+        for server_id, users in past_nicknames.items():
+            shard = self._load("nicks_" + server_id)
+            for user_id, nicks in users.items():
+                if user_id in shard:
+                    continue
+                for nick in nicks:
+                    self.add_nickname(server_id, user_id, nick)
+        self.flush()
+
+    def export(self):
+        """Returns all the history, laid out like past_names.json and
+        past_nicknames.json"""
+        self.flush()
+        names = {}
+        nicknames = {}
+        for filename in os.listdir(self.path):
+            shard, ext = os.path.splitext(filename)
+            if ext != ".jsonl":
+                continue
+            entries = {k: list(v) for k, v in self._load(shard).items()}
+            if shard.startswith("nicks_"):
+                nicknames[shard[len("nicks_"):]] = entries
+            else:
+                names.update(entries)
+        return names, nicknames
+
+    def flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        pending, self._pending = self._pending, defaultdict(list)
+        for shard, records in pending.items():
+            try:
+                self._write(shard, records)
+            except Exception:
+                logger.exception("Could not save name history shard {}"
+                                 "".format(shard))
+
+    def close(self):
+        self.flush()
+        atexit.unregister(self.flush)
+
+    def _names_shard(self, user_id):
+        return "names_{}".format(int(user_id) % self.NAME_BUCKETS)
+
+    def _shard_path(self, shard):
+        return os.path.join(self.path, shard + ".jsonl")
+
+    def _add(self, shard, key, value):
+        entries = self._load(shard)
+        history = entries.get(key)
+        if history is None:
+            history = entries[key] = deque(maxlen=self.MAX_NAMES)
+        elif value in history:
+            return False
+        history.append(value)
+        self._pending[shard].append([key, value])
+        if self._flush_handle is None:
+            self._flush_handle = self.loop.call_later(self.FLUSH_INTERVAL,
+                                                      self.flush)
+        return True
+
+    def _load(self, shard):
+        try:
+            return self._shards[shard]
+        except KeyError:
+            pass
+        entries = {}
+        lines = 0
+        try:
+            with open(self._shard_path(shard), encoding="utf-8") as f:
+                for line in f:
+                    lines += 1
+                    try:
+                        key, value = json.loads(line)
+                    except ValueError:  # Torn write
+                        continue
+                    history = entries.get(key)
+                    if history is None:
+                        history = entries[key] = deque(maxlen=self.MAX_NAMES)
+                    if value not in history:
+                        history.append(value)
+        except FileNotFoundError:
+            pass
+        self._shards[shard] = entries
+        self._lines[shard] = lines
+        return entries
+
+    def _write(self, shard, records):
+        entries = self._shards[shard]
+        live = sum(len(history) for history in entries.values())
+        path = self._shard_path(shard)
+        if self._lines[shard] + len(records) > live * 2 + 100:
+            # Mostly names pushed out by newer ones, rewrite the shard
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for key, history in entries.items():
+                    for value in history:
+                        f.write(json.dumps([key, value]) + "\n")
+            os.replace(tmp_path, path)
+            self._lines[shard] = live
+        else:
+            with open(path, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(r) + "\n" for r in records))
+            self._lines[shard] += len(records)
+
+
+class SQLiteNameHistory:
+    """Past usernames and nicknames of users, kept in the SQLite store
+
+    Nothing is held in memory, lookups are indexed queries. Whether
+    a name was already recorded is checked by the store"""
+
+    MAX_NAMES = NameHistory.MAX_NAMES
+
+    def __init__(self, store):
+        self.store = store
+
+    async def get_names(self, user_id):
+        return await self.store.get_names(user_id)
+
+    async def get_nicknames(self, server_id, user_id):
+        return await self.store.get_nicknames(server_id, user_id)
+
+    def add_name(self, user_id, name):
+        self.store.add_name(user_id, name, self.MAX_NAMES)
+
+    def add_nickname(self, server_id, user_id, nick):
+        self.store.add_nickname(server_id, user_id, nick, self.MAX_NAMES)
+
+    def close(self):
+        pass
+
+
+class ServerCases:
+    """A server's mod-log cases, indexed by user, moderator and action
+
+    Case numbers come from a counter that is saved with the cases,
+    so they are never reused"""
+
+    def __init__(self, path, data=None):
+        self.path = path
+        if path is not None:
+            dataIO.set_profile(path, "compact")
+        if data is None:
+            data = dataIO.load_json(path) if os.path.isfile(path) else {}
+        self.cases = data.get("cases", {})
+        self.counter = data.get("counter", 0)
+        self.last_case = data.get("last_case", {})
+        self._by_user = defaultdict(list)
+        self._by_moderator = defaultdict(list)
+        self._by_action = defaultdict(list)
+        self._by_message = defaultdict(list)
+        self._rendered = {}
+        for case in sorted(self.cases.values(), key=lambda c: c["case"]):
+            self._index(case)
+
+    def __len__(self):
+        return len(self.cases)
+
+    def get(self, case_n):
+        """Returns the case, raises KeyError if it doesn't exist"""
+        return self.cases[str(case_n)]
+
+    def add(self, case, *, mod=None):
+        """Numbers the case and stores it"""
+        self.counter += 1
+        case["case"] = self.counter
+        self.cases[str(self.counter)] = case
+        self._index(case)
+        if mod is not None:
+            self.last_case[mod.id] = self.counter
+        self.save(case)
+        return self.counter
+
+    def render(self, case, formatter):
+        """Returns formatter(case), cached until the case is changed"""
+        rendered = self._rendered.setdefault(case["case"], {})
+        try:
+            return rendered[formatter.__name__]
+        except KeyError:
+            text = rendered[formatter.__name__] = formatter(case)
+            return text
+
+    def changed(self, case):
+        """Drops the case's cached renderings"""
+        self._rendered.pop(case["case"], None)
+
+    def search(self, text):
+        """Returns the cases whose reason contains text"""
+        text = text.lower()
+        return [c for c in sorted(self.cases.values(), key=lambda c: c["case"])
+                if c["reason"] and text in c["reason"].lower()]
+
+    def set_moderator(self, case, mod):
+        """Assigns a case nobody has claimed to mod"""
+        case["moderator"] = str(mod)
+        case["moderator_id"] = mod.id
+        self._by_moderator[mod.id].append(case["case"])
+
+    def by_user(self, user_id):
+        return [self.get(n) for n in self._by_user.get(user_id, ())]
+
+    def by_moderator(self, mod_id):
+        return [self.get(n) for n in self._by_moderator.get(mod_id, ())]
+
+    def by_action(self, action):
+        return [self.get(n) for n in self._by_action.get(action, ())]
+
+    def by_message(self, message_id):
+        """Returns the cases sharing the mod-log message"""
+        return [self.get(n) for n in self._by_message.get(message_id, ())]
+
+    def set_message(self, cases, message_id):
+        """Records the mod-log message the cases were sent in"""
+        for case in cases:
+            case["message"] = message_id
+            self._by_message[message_id].append(case["case"])
+        self.save(*cases)
+
+    def reset(self):
+        """Deletes all cases, numbering goes on from the last one"""
+        self.cases.clear()
+        self.last_case.clear()
+        self._rendered.clear()
+        self._by_user.clear()
+        self._by_moderator.clear()
+        self._by_action.clear()
+        self._by_message.clear()
+        self.save()
+
+    def save(self, *cases):
+        """Saves the changed cases, all of them if none are passed
+
+        The whole file is rewritten either way"""
+        data = {"counter": self.counter, "last_case": self.last_case,
+                "cases": self.cases}
+        dataIO.save_json_deferred(self.path, data)
+
+    def export(self):
+        """Returns the cases laid out like the server's JSON file"""
+        return {"counter": self.counter, "last_case": self.last_case,
+                "cases": self.cases}
+
+    def _index(self, case):
+        n = case["case"]
+        self.counter = max(self.counter, n)
+        self._by_user[case["user_id"]].append(n)
+        if case["moderator_id"] is not None:
+            self._by_moderator[case["moderator_id"]].append(n)
+        self._by_action[case["action"]].append(n)
+        if case.get("message") is not None:
+            self._by_message[case["message"]].append(n)
 
-        async def delete_value():
-            await asyncio.sleep(seconds)
-            self._cache.remove(tmp)
 
-        self.bot.loop.create_task(delete_value())
+class SQLiteServerCases(ServerCases):
+    """A server's mod-log cases, stored as rows of the SQLite store
 
-    def check(self, user, server, action):
-        return (user.id, server.id, action) in self._cache
+    Only the changed cases are written"""
+
+    def __init__(self, store, server_id):
+        self.store = store
+        self.server_id = server_id
+        super().__init__(None, store.load_cases(server_id))
+
+    def save(self, *cases):
+        """Saves the changed cases, all of them if none are passed"""
+        replace = not cases
+        if replace:
+            cases = self.cases.values()
+        self.store.save_cases(self.server_id, self.counter, self.last_case,
+                              cases, replace=replace)
+
+
+class ModLogOutbox:
+    """Sends mod-log cases through one worker per channel
+
+    Cases queued while a message is being sent are merged into as
+    few messages as possible. With a single request in flight per
+    channel, a raid doesn't flood the rate limit bucket that
+    discord.py's HTTP client is already pacing. Cases changed while
+    their message was being sent are edited once it's sent"""
+
+    MAX_LENGTH = 2000
+    RETRIES = 3
+
+    def __init__(self, bot, render):
+        self.bot = bot
+        self.render = render
+        self._queues = defaultdict(deque)
+        self._workers = {}
+        self._channels = {}
+        self._sending = {}
+        self._pending = set()
+
+    def post(self, channel, server_cases, case):
+        self._channels[channel.id] = channel
+        self._queues[channel.id].append((server_cases, case))
+        self._pending.add((channel.server.id, case["case"]))
+        worker = self._workers.get(channel.id)
+        if worker is None or worker.done():
+            self._workers[channel.id] = self.bot.loop.create_task(
+                self._work(channel))
+
+    def is_pending(self, server, case):
+        """Whether the case is waiting to be sent or being sent"""
+        return (server.id, case["case"]) in self._pending
+
+    def close(self):
+        """Stops the workers and returns the cases left unsent
+
+        As {channel_id: [[server_id, case_n], ...]}, including the
+        cases that were being sent when the workers were stopped"""
+        unsent = {}
+        for channel_id, worker in self._workers.items():
+            worker.cancel()
+            server_id = self._channels[channel_id].server.id
+            cases = list(self._sending.get(channel_id, ()))
+            cases += [case for _, case in self._queues[channel_id]]
+            unsent[channel_id] = [[server_id, c["case"]] for c in cases]
+        return unsent
+
+    async def _work(self, channel):
+        queue = self._queues[channel.id]
+        while queue:
+            server_cases, case = queue.popleft()
+            batch = [case]
+            text = self.render(server_cases, case)
+            while queue and queue[0][0] is server_cases:
+                more = self.render(*queue[0])
+                if len(text) + 1 + len(more) > self.MAX_LENGTH:
+                    break
+                text += "\n" + more
+                batch.append(queue.popleft()[1])
+            self._sending[channel.id] = batch
+            msg = await self._send(channel, text)
+            if msg is not None:
+                server_cases.set_message(batch, msg.id)
+                await self._edit_changed(channel, server_cases, batch, msg,
+                                         text)
+            del self._sending[channel.id]
+            for case in batch:
+                self._pending.discard((channel.server.id, case["case"]))
+        del self._queues[channel.id]
+        del self._workers[channel.id]
+        del self._channels[channel.id]
+
+    async def _edit_changed(self, channel, server_cases, batch, msg, text):
+        # Cases whose reason was set while the message was being sent
+        new_text = "\n".join(self.render(server_cases, c) for c in batch)
+        if new_text == text:
+            return
+        try:
+            await self.bot.http.edit_message(msg.id, channel.id, new_text)
+        except discord.HTTPException:
+            logger.exception("Could not edit mod-log message")
+
+    async def _send(self, channel, text):
+        for attempt in range(self.RETRIES):
+            try:
+                return await self.bot.send_message(channel, text)
+            except (discord.Forbidden, discord.NotFound):
+                return None
+            except discord.HTTPException:
+                await asyncio.sleep(2 ** attempt)
+            except Exception:
+                logger.exception("Could not send mod-log message")
+                return None
+        return None
+
+
+class ModLog:
+    """Mod-log cases of all servers, stored in one file per server
+
+    A server's cases are loaded the first time they're needed"""
+
+    def __init__(self, path):
+        self.path = path
+        self._servers = {}
+        os.makedirs(path, exist_ok=True)
+
+    def __getitem__(self, server_id):
+        try:
+            return self._servers[server_id]
+        except KeyError:
+            cases = self._servers[server_id] = self._load(server_id)
+            return cases
+
+    def server_ids(self):
+        """Returns the IDs of the servers that have cases stored"""
+        return [os.path.splitext(f)[0] for f in os.listdir(self.path)
+                if f.endswith(".json") and f[0].isdigit()]
+
+    def _load(self, server_id):
+        return ServerCases(self._server_path(server_id))
+
+    def import_json(self, modlog):
+        """Splits the old modlog.json data into per-server files
+
+        Servers that already have a file are skipped, those were
+        imported by an earlier, interrupted run"""
+        for server_id, cases in modlog.items():
+            path = self._server_path(server_id)
+            if os.path.isfile(path):
+                continue
+            server_cases = ServerCases(path, {"cases": cases})
+            server_cases.save()
+            dataIO.flush(path)
+            self._servers[server_id] = server_cases
+
+    def _server_path(self, server_id):
+        return os.path.join(self.path, server_id + ".json")
+
+
+class SQLiteModLog(ModLog):
+    """Mod-log cases of all servers, stored in the SQLite store"""
+
+    def __init__(self, store):
+        self.store = store
+        self._servers = {}
+
+    def _load(self, server_id):
+        return SQLiteServerCases(self.store, server_id)
+
+
+class Purger:
+    """Deletes channel history matching a check
+
+    Each history page is fetched while the matches from the previous
+    one are being deleted. Messages older than 14 days can't be bulk
+    deleted, so they're told apart by their snowflake and deleted one
+    by one. Instead of sleeping between requests, the delay for a
+    channel grows when a rate limit still surfaces from discord.py's
+    HTTP client and shrinks again after each successful request"""
+
+    DISCORD_EPOCH = 1420070400000
+    BULK_MAX_AGE = 14 * 24 * 60 * 60 - 60
+    PAGE_SIZE = 100
+    MAX_DELAY = 10
+    RETRIES = 3
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._delays = {}
+
+    async def purge(self, channel, check, number, *, before=None,
+                    include=(), pages=5, bulk=True):
+        """Deletes up to number messages passing check, plus include
+
+        Returns how many messages were deleted"""
+        batch = list(include)
+        found = deleted = 0
+        pending = self.bot.loop.create_task(self._fetch(channel, before))
+        try:
+            while pending is not None:
+                page = await pending
+                pending = None
+                pages -= 1
+                for message in page:
+                    if found < number and check(message):
+                        batch.append(message)
+                        found += 1
+                if page and pages and found < number:
+                    pending = self.bot.loop.create_task(
+                        self._fetch(channel, page[-1]))
+                deleted += await self.delete(channel, batch, bulk=bulk)
+                batch = []
+        finally:
+            if pending is not None:
+                pending.cancel()
+        return deleted
+
+    async def delete(self, channel, messages, *, bulk=True):
+        """Deletes messages, in bulk where possible
+
+        Returns how many messages were deleted"""
+        if bulk:
+            min_id = self.bulk_min_id()
+            recent = [m for m in messages if int(m.id) > min_id]
+            single = [m for m in messages if int(m.id) <= min_id]
+        else:
+            recent = []
+            single = list(messages)
+        deleted = 0
+        for i in range(0, len(recent), 100):
+            chunk = recent[i:i+100]
+            if len(chunk) == 1:
+                single.extend(chunk)
+            elif await self._bulk_delete(channel, chunk):
+                deleted += len(chunk)
+            else:
+                single.extend(chunk)
+        for message in single:
+            if await self._single_delete(channel, message):
+                deleted += 1
+        return deleted
+
+    def bulk_min_id(self):
+        """Snowflakes at or below this are too old for bulk deletion"""
+        ms = int((time.time() - self.BULK_MAX_AGE) * 1000)
+        return (ms - self.DISCORD_EPOCH) << 22
+
+    async def _fetch(self, channel, before):
+        page = []
+        async for message in self.bot.logs_from(channel, before=before,
+                                                limit=self.PAGE_SIZE):
+            page.append(message)
+        return page
+
+    async def _bulk_delete(self, channel, messages):
+        try:
+            await self._paced(channel, self.bot.delete_messages, messages)
+        except discord.HTTPException:
+            return False
+        return True
+
+    async def _single_delete(self, channel, message):
+        try:
+            await self._paced(channel, self.bot.delete_message, message)
+        except discord.HTTPException:
+            return False
+        return True
+
+    async def _paced(self, channel, func, *args):
+        for attempt in range(self.RETRIES):
+            delay = self._delays.get(channel.id, 0)
+            if delay:
+                await asyncio.sleep(delay)
+            try:
+                result = await func(*args)
+            except discord.HTTPException as e:
+                if getattr(e.response, "status", None) != 429:
+                    raise
+                self._delays[channel.id] = min(max(delay * 2, 1),
+                                               self.MAX_DELAY)
+                if attempt == self.RETRIES - 1:
+                    raise
+            else:
+                if delay:
+                    delay /= 2
+                    if delay < 0.1:
+                        self._delays.pop(channel.id, None)
+                    else:
+                        self._delays[channel.id] = delay
+                return result
 
 
 class Mod:
@@ -95,17 +868,107 @@ class Mod:
     def __init__(self, bot):
         self.bot = bot
         self.ignore_list = dataIO.load_json("data/mod/ignorelist.json")
+        self.ignored_servers = set(self.ignore_list["SERVERS"])
+        self.ignored_channels = set(self.ignore_list["CHANNELS"])
         self.filter = dataIO.load_json("data/mod/filter.json")
-        self.past_names = dataIO.load_json("data/mod/past_names.json")
-        self.past_nicknames = dataIO.load_json("data/mod/past_nicknames.json")
+        self._word_filters = {}
+        self.name_history = NameHistory("data/mod/names", loop=bot.loop)
+        if not os.path.isfile(NAMES_IMPORTED):
+            self.import_name_history()
         settings = dataIO.load_json("data/mod/settings.json")
         self.settings = defaultdict(lambda: default_settings.copy(), settings)
-        self.cache = OrderedDict()
-        self.cases = dataIO.load_json("data/mod/modlog.json")
-        self.last_case = defaultdict(dict)
+        self.repeats = RepeatDetector()
+        self.modlog = ModLog("data/mod/modlog")
+        if not os.path.isfile(MODLOG_IMPORTED):
+            if os.path.isfile("data/mod/modlog.json"):
+                modlog = dataIO.load_json("data/mod/modlog.json")
+                self.modlog.import_json(modlog)
+            with open(MODLOG_IMPORTED, "w"):
+                pass
+        self.store = None
+        if bot.settings.storage == "sqlite":
+            self.store = SQLiteStore()
+            if not self.store.is_imported("mod"):
+                self.import_to_sqlite()
+            self.name_history.close()
+            self.name_history = SQLiteNameHistory(self.store)
+            self.modlog = SQLiteModLog(self.store)
+        self.modlog_outbox = ModLogOutbox(
+            bot, lambda cases, case: cases.render(case, self.format_case_msg))
+        self._resume_task = None
+        if os.path.isfile(UNSENT_CASES):
+            self._resume_task = bot.loop.create_task(self.resume_modlog())
         self.temp_cache = TempCache(bot)
+        self.purger = Purger(bot)
         perms_cache = dataIO.load_json("data/mod/perms_cache.json")
         self._perms_cache = defaultdict(dict, perms_cache)
+        bot.add_message_handler(self.check_message, server_only=True)
+
+    def __unload(self):
+        self.bot.remove_message_handler(self.check_message)
+        self.temp_cache.close()
+        self.name_history.close()
+        if self._resume_task is not None:
+            self._resume_task.cancel()
+        unsent = self.modlog_outbox.close()
+        if unsent:
+            # Already numbered and saved, the next load posts them
+            if os.path.isfile(UNSENT_CASES):
+                older = dataIO.load_json(UNSENT_CASES)
+                for channel_id, cases in older.items():
+                    unsent[channel_id] = cases + unsent.get(channel_id, [])
+            dataIO.save_json(UNSENT_CASES, unsent)
+        if self.store is not None:
+            self.store.close()
+
+    def import_to_sqlite(self):
+        """Copies the cases and the name history into the SQLite store
+
+        Loaded through the JSON layouts on the event loop, the store
+        only gets plain data to insert"""
+        print("Moving mod-log cases and name history to SQLite...")
+        dataIO.flush()
+        servers = {sid: self.modlog[sid].export()
+                   for sid in self.modlog.server_ids()}
+        self.store.import_mod(servers, *self.name_history.export())
+
+    async def resume_modlog(self):
+        """Posts the cases the outbox couldn't send before an unload"""
+        await self.bot.wait_until_ready()
+        unsent = dataIO.load_json(UNSENT_CASES)
+        os.remove(UNSENT_CASES)
+        for channel_id, cases in unsent.items():
+            channel = self.bot.get_channel(channel_id)
+            if channel is None:
+                continue
+            posted = set()
+            for server_id, case_n in cases:
+                server_cases = self.modlog[server_id]
+                try:
+                    case = server_cases.get(case_n)
+                except KeyError:  # Cases reset in the meantime
+                    continue
+                if case.get("message") is None and case_n not in posted:
+                    posted.add(case_n)
+                    self.modlog_outbox.post(channel, server_cases, case)
+
+    def import_name_history(self):
+        """Moves the names from past_names/past_nicknames.json"""
+        files = ("data/mod/past_names.json", "data/mod/past_nicknames.json")
+        data = [dataIO.load_json(f) if os.path.isfile(f) else {}
+                for f in files]
+        if any(data):
+            print("Importing name history...")
+        self.name_history.import_json(*data)
+        # Only once it's complete, an interrupted import starts over
+        with open(NAMES_IMPORTED, "w"):
+            pass
+
+    async def save_ignore_list(self):
+        self.ignored_servers = set(self.ignore_list["SERVERS"])
+        self.ignored_channels = set(self.ignore_list["CHANNELS"])
+        await dataIO.save_json_async("data/mod/ignorelist.json",
+                                     self.ignore_list)
 
     @commands.group(pass_context=True, no_pm=True)
     @checks.serverowner_or_permissions(administrator=True)
@@ -159,7 +1022,7 @@ class Mod:
                 return
             self.settings[server.id]["mod-log"] = None
             await self.bot.say("Mod log deactivated.")
-        dataIO.save_json("data/mod/settings.json", self.settings)
+        await dataIO.save_json_async("data/mod/settings.json", self.settings)
 
     @modset.command(pass_context=True, no_pm=True)
     async def banmentionspam(self, ctx, max_mentions : int=False):
@@ -181,27 +1044,47 @@ class Mod:
                 return
             self.settings[server.id]["ban_mention_spam"] = False
             await self.bot.say("Autoban for mention spam disabled.")
-        dataIO.save_json("data/mod/settings.json", self.settings)
+        await dataIO.save_json_async("data/mod/settings.json", self.settings)
 
     @modset.command(pass_context=True, no_pm=True)
-    async def deleterepeats(self, ctx):
-        """Enables auto deletion of repeated messages"""
+    async def deleterepeats(self, ctx, repeats: int=None, window: int=0):
+        """Enables auto deletion of repeated messages
+
+        Without arguments, toggles the deletion.
+        repeats: identical messages in a row deleted from (2-20, default 3)
+        window: seconds they must be sent within, 0 for no limit"""
         server = ctx.message.server
-        if not self.settings[server.id]["delete_repeats"]:
-            self.settings[server.id]["delete_repeats"] = True
-            await self.bot.say("Messages repeated up to 3 times will "
-                               "be deleted.")
-        else:
-            self.settings[server.id]["delete_repeats"] = False
+        settings = self.settings[server.id]
+        if repeats is None and settings["delete_repeats"]:
+            settings["delete_repeats"] = False
             await self.bot.say("Repeated messages will be ignored.")
-        dataIO.save_json("data/mod/settings.json", self.settings)
+        else:
+            if repeats is not None:
+                if not 2 <= repeats <= 20:
+                    await self.bot.say("Repeats must be between 2 and 20.")
+                    return
+                if not 0 <= window <= self.repeats.expiry:
+                    await self.bot.say("The window must be between 0 and {} "
+                                       "seconds.".format(self.repeats.expiry))
+                    return
+                settings["repeat_count"] = repeats
+                settings["repeat_window"] = window
+            settings["delete_repeats"] = True
+            within = ""
+            if settings.get("repeat_window"):
+                within = " within {} seconds".format(settings["repeat_window"])
+            await self.bot.say("Messages sent {} or more times in a row{} "
+                               "will be deleted, starting from the repeat "
+                               "that reaches that count."
+                               "".format(settings.get("repeat_count", 3),
+                                         within))
+        await dataIO.save_json_async("data/mod/settings.json", self.settings)
 
     @modset.command(pass_context=True, no_pm=True)
     async def resetcases(self, ctx):
         """Resets modlog's cases"""
         server = ctx.message.server
-        self.cases[server.id] = {}
-        dataIO.save_json("data/mod/modlog.json", self.cases)
+        self.modlog[server.id].reset()
         await self.bot.say("Cases have been reset.")
 
     @modset.command(pass_context=True, no_pm=True)
@@ -219,7 +1102,7 @@ class Mod:
             else:
                 await self.bot.say("Delete delay set to {}"
                                    " seconds.".format(time))
-            dataIO.save_json("data/mod/settings.json", self.settings)
+            await dataIO.save_json_async("data/mod/settings.json", self.settings)
         else:
             try:
                 delay = self.settings[server.id]["delete_delay"]
@@ -273,7 +1156,7 @@ class Mod:
                                                  default_settings[action])
             if value != enabled:
                 self.settings[server.id][action] = enabled
-                dataIO.save_json("data/mod/settings.json", self.settings)
+                await dataIO.save_json_async("data/mod/settings.json", self.settings)
             msg = ('Case creation for %s actions %s %s.' %
                    (name.lower(),
                     'was already' if enabled == value else 'is now',
@@ -296,7 +1179,7 @@ class Mod:
             self.settings[server.id]["respect_hierarchy"] = False
             await self.bot.say("Role hierarchy will be ignored when "
                                "moderation commands are issued.")
-        dataIO.save_json("data/mod/settings.json", self.settings)
+        await dataIO.save_json_async("data/mod/settings.json", self.settings)
 
     @commands.command(no_pm=True, pass_context=True)
     @checks.admin_or_permissions(kick_members=True)
@@ -531,7 +1414,7 @@ class Mod:
                                "permission and the user I'm muting must be "
                                "lower than myself in the role hierarchy.")
         else:
-            dataIO.save_json("data/mod/perms_cache.json", self._perms_cache)
+            await dataIO.save_json_async("data/mod/perms_cache.json", self._perms_cache)
             await self.new_case(server,
                                 action="CMUTE",
                                 channel=channel,
@@ -576,7 +1459,7 @@ class Mod:
             await self.bot.say("That user is already muted in all channels.")
             return
         self._perms_cache[user.id] = register
-        dataIO.save_json("data/mod/perms_cache.json", self._perms_cache)
+        await dataIO.save_json_async("data/mod/perms_cache.json", self._perms_cache)
         await self.new_case(server,
                             action="SMUTE",
                             mod=author,
@@ -635,7 +1518,7 @@ class Mod:
                 pass
             if user.id in self._perms_cache and not self._perms_cache[user.id]:
                 del self._perms_cache[user.id]  # cleanup
-            dataIO.save_json("data/mod/perms_cache.json", self._perms_cache)
+            await dataIO.save_json_async("data/mod/perms_cache.json", self._perms_cache)
             await self.bot.say("User has been unmuted in this channel.")
 
     @checks.mod_or_permissions(administrator=True)
@@ -682,7 +1565,7 @@ class Mod:
                     await asyncio.sleep(0.1)
         if user.id in self._perms_cache and not self._perms_cache[user.id]:
             del self._perms_cache[user.id]  # cleanup
-        dataIO.save_json("data/mod/perms_cache.json", self._perms_cache)
+        await dataIO.save_json_async("data/mod/perms_cache.json", self._perms_cache)
         await self.bot.say("User has been unmuted in this server.")
 
     @commands.group(pass_context=True)
@@ -708,38 +1591,19 @@ class Mod:
         has_permissions = channel.permissions_for(server.me).manage_messages
 
         def check(m):
-            if text in m.content:
-                return True
-            elif m == ctx.message:
-                return True
-            else:
-                return False
-
-        to_delete = [ctx.message]
+            return text in m.content
 
         if not has_permissions:
             await self.bot.say("I'm not allowed to delete messages.")
             return
 
-        tries_left = 5
-        tmp = ctx.message
-
-        while tries_left and len(to_delete) - 1 < number:
-            async for message in self.bot.logs_from(channel, limit=100,
-                                                    before=tmp):
-                if len(to_delete) - 1 < number and check(message):
-                    to_delete.append(message)
-                tmp = message
-            tries_left -= 1
+        deleted = await self.purger.purge(channel, check, number,
+                                          before=ctx.message,
+                                          include=[ctx.message], bulk=is_bot)
 
         logger.info("{}({}) deleted {} messages "
                     " containing '{}' in channel {}".format(author.name,
-                    author.id, len(to_delete), text, channel.id))
-
-        if is_bot:
-            await self.mass_purge(to_delete)
-        else:
-            await self.slow_deletion(to_delete)
+                    author.id, deleted, text, channel.id))
 
     @cleanup.command(pass_context=True, no_pm=True)
     async def user(self, ctx, user: discord.Member, number: int):
@@ -757,41 +1621,23 @@ class Mod:
         self_delete = user == self.bot.user
 
         def check(m):
-            if m.author == user:
-                return True
-            elif m == ctx.message:
-                return True
-            else:
-                return False
-
-        to_delete = [ctx.message]
+            return m.author == user
 
         if not has_permissions and not self_delete:
             await self.bot.say("I'm not allowed to delete messages.")
             return
 
-        tries_left = 5
-        tmp = ctx.message
-
-        while tries_left and len(to_delete) - 1 < number:
-            async for message in self.bot.logs_from(channel, limit=100,
-                                                    before=tmp):
-                if len(to_delete) - 1 < number and check(message):
-                    to_delete.append(message)
-                tmp = message
-            tries_left -= 1
+        # For whatever reason the purge endpoint requires manage_messages
+        deleted = await self.purger.purge(channel, check, number,
+                                          before=ctx.message,
+                                          include=[ctx.message],
+                                          bulk=is_bot and not self_delete)
 
         logger.info("{}({}) deleted {} messages "
                     " made by {}({}) in channel {}"
-                    "".format(author.name, author.id, len(to_delete),
+                    "".format(author.name, author.id, deleted,
                               user.name, user.id, channel.name))
 
-        if is_bot and not self_delete:
-            # For whatever reason the purge endpoint requires manage_messages
-            await self.mass_purge(to_delete)
-        else:
-            await self.slow_deletion(to_delete)
-
     @cleanup.command(pass_context=True, no_pm=True)
     async def after(self, ctx, message_id : int):
         """Deletes all messages after specified message
@@ -829,11 +1675,11 @@ class Mod:
                                                 after=after):
             to_delete.append(message)
 
+        deleted = await self.purger.delete(channel, to_delete)
+
         logger.info("{}({}) deleted {} messages in channel {}"
                     "".format(author.name, author.id,
-                              len(to_delete), channel.name))
-
-        await self.mass_purge(to_delete)
+                              deleted, channel.name))
 
     @cleanup.command(pass_context=True, no_pm=True)
     async def messages(self, ctx, number: int):
@@ -848,23 +1694,19 @@ class Mod:
         is_bot = self.bot.user.bot
         has_permissions = channel.permissions_for(server.me).manage_messages
 
-        to_delete = []
-
         if not has_permissions:
             await self.bot.say("I'm not allowed to delete messages.")
             return
 
-        async for message in self.bot.logs_from(channel, limit=number+1):
-            to_delete.append(message)
+        pages = number // Purger.PAGE_SIZE + 1
+        deleted = await self.purger.purge(channel, lambda m: True, number,
+                                          before=ctx.message,
+                                          include=[ctx.message],
+                                          pages=pages, bulk=is_bot)
 
         logger.info("{}({}) deleted {} messages in channel {}"
                     "".format(author.name, author.id,
-                              number, channel.name))
-
-        if is_bot:
-            await self.mass_purge(to_delete)
-        else:
-            await self.slow_deletion(to_delete)
+                              deleted, channel.name))
 
     @cleanup.command(pass_context=True, no_pm=True, name='bot')
     async def cleanup_bot(self, ctx, number: int):
@@ -876,56 +1718,28 @@ class Mod:
         is_bot = self.bot.user.bot
         has_permissions = channel.permissions_for(server.me).manage_messages
 
-        prefixes = self.bot.command_prefix
-        if isinstance(prefixes, str):
-            prefixes = [prefixes]
-        elif callable(prefixes):
-            if asyncio.iscoroutine(prefixes):
-                await self.bot.say('Coroutine prefixes not yet implemented.')
-                return
-            prefixes = prefixes(self.bot, ctx.message)
-
-        # In case some idiot sets a null prefix
-        if '' in prefixes:
-            prefixes.pop('')
-
         def check(m):
             if m.author.id == self.bot.user.id:
                 return True
-            elif m == ctx.message:
-                return True
-            p = discord.utils.find(m.content.startswith, prefixes)
-            if p and len(p) > 0:
+            # Empty prefixes are never matched
+            p = self.bot.settings.match_prefix(server, m.content)
+            if p:
                 return m.content[len(p):].startswith(tuple(self.bot.commands))
             return False
 
-        to_delete = [ctx.message]
-
         if not has_permissions:
             await self.bot.say("I'm not allowed to delete messages.")
             return
 
-        tries_left = 5
-        tmp = ctx.message
-
-        while tries_left and len(to_delete) - 1 < number:
-            async for message in self.bot.logs_from(channel, limit=100,
-                                                    before=tmp):
-                if len(to_delete) - 1 < number and check(message):
-                    to_delete.append(message)
-                tmp = message
-            tries_left -= 1
+        deleted = await self.purger.purge(channel, check, number,
+                                          before=ctx.message,
+                                          include=[ctx.message], bulk=is_bot)
 
         logger.info("{}({}) deleted {} "
                     " command messages in channel {}"
-                    "".format(author.name, author.id, len(to_delete),
+                    "".format(author.name, author.id, deleted,
                               channel.name))
 
-        if is_bot:
-            await self.mass_purge(to_delete)
-        else:
-            await self.slow_deletion(to_delete)
-
     @cleanup.command(pass_context=True, name='self')
     async def cleanup_self(self, ctx, number: int, match_pattern: str = None):
         """Cleans up messages owned by the bot.
@@ -971,22 +1785,14 @@ class Mod:
                 return True
             return False
 
-        to_delete = []
+        include = []
         # Selfbot convenience, delete trigger message
         if author == self.bot.user:
-            to_delete.append(ctx.message)
-            number += 1
-
-        tries_left = 5
-        tmp = ctx.message
+            include.append(ctx.message)
 
-        while tries_left and len(to_delete) < number:
-            async for message in self.bot.logs_from(channel, limit=100,
-                                                    before=tmp):
-                if len(to_delete) < number and check(message):
-                    to_delete.append(message)
-                tmp = message
-            tries_left -= 1
+        deleted = await self.purger.purge(channel, check, number,
+                                          before=ctx.message, include=include,
+                                          bulk=is_bot and can_mass_purge)
 
         if channel.name:
             channel_name = 'channel ' + channel.name
@@ -995,14 +1801,9 @@ class Mod:
 
         logger.info("{}({}) deleted {} messages "
                     "sent by the bot in {}"
-                    "".format(author.name, author.id, len(to_delete),
+                    "".format(author.name, author.id, deleted,
                               channel_name))
 
-        if is_bot and can_mass_purge:
-            await self.mass_purge(to_delete)
-        else:
-            await self.slow_deletion(to_delete)
-
     @commands.command(pass_context=True)
     @checks.mod_or_permissions(manage_messages=True)
     async def reason(self, ctx, case, *, reason : str=""):
@@ -1021,7 +1822,7 @@ class Mod:
                 reason = "{} {}".format(case, reason)
             else:
                 reason = case
-            case = self.last_case[server.id].get(author.id)
+            case = self.modlog[server.id].last_case.get(author.id)
             if case is None:
                 await send_cmd_help(ctx)
                 return
@@ -1042,6 +1843,65 @@ class Mod:
         else:
             await self.bot.say("Case #{} updated.".format(case))
 
+    @commands.group(pass_context=True, no_pm=True)
+    @checks.mod_or_permissions(manage_messages=True)
+    async def cases(self, ctx):
+        """Looks up mod-log cases"""
+        if ctx.invoked_subcommand is None:
+            await send_cmd_help(ctx)
+
+    @cases.command(name="user", pass_context=True)
+    async def cases_user(self, ctx, *, user: str):
+        """Lists the cases of a user
+
+        Users who left the server can be looked up by ID"""
+        server = ctx.message.server
+        match = re.fullmatch(r"<@!?(\d+)>|(\d+)", user)
+        if match:
+            user_id = match.group(1) or match.group(2)
+        else:
+            member = server.get_member_named(user)
+            if member is None:
+                await self.bot.say("User not found.")
+                return
+            user_id = member.id
+        server_cases = self.modlog[server.id]
+        found = server_cases.by_user(user_id)
+        if not found:
+            await self.bot.say("That user doesn't have any case.")
+            return
+        await self.send_case_list(server_cases, found)
+
+    @cases.command(name="search", pass_context=True)
+    async def cases_search(self, ctx, *, text: str):
+        """Lists the cases whose reason contains text"""
+        server = ctx.message.server
+        server_cases = self.modlog[server.id]
+        found = server_cases.search(text)
+        if not found:
+            await self.bot.say("No case matches that.")
+            return
+        await self.send_case_list(server_cases, found)
+
+    @commands.command(pass_context=True, no_pm=True)
+    @checks.mod_or_permissions(manage_messages=True)
+    async def case(self, ctx, number: int):
+        """Shows a mod-log case"""
+        server = ctx.message.server
+        server_cases = self.modlog[server.id]
+        try:
+            case = server_cases.get(number)
+        except KeyError:
+            await self.bot.say("That case doesn't exist.")
+            return
+        await self.bot.say(server_cases.render(case, self.format_case_msg))
+
+    async def send_case_list(self, server_cases, cases):
+        msg = "\n".join(server_cases.render(c, self.format_case_summary)
+                        for c in cases)
+        for page in pagify(msg, shorten_by=16):
+            await self.bot.say(box(page))
+
     @commands.group(pass_context=True, no_pm=True)
     @checks.admin_or_permissions(manage_channels=True)
     async def ignore(self, ctx):
@@ -1057,16 +1917,16 @@ class Mod:
         Defaults to current one"""
         current_ch = ctx.message.channel
         if not channel:
-            if current_ch.id not in self.ignore_list["CHANNELS"]:
+            if current_ch.id not in self.ignored_channels:
                 self.ignore_list["CHANNELS"].append(current_ch.id)
-                dataIO.save_json("data/mod/ignorelist.json", self.ignore_list)
+                await self.save_ignore_list()
                 await self.bot.say("Channel added to ignore list.")
             else:
                 await self.bot.say("Channel already in ignore list.")
         else:
-            if channel.id not in self.ignore_list["CHANNELS"]:
+            if channel.id not in self.ignored_channels:
                 self.ignore_list["CHANNELS"].append(channel.id)
-                dataIO.save_json("data/mod/ignorelist.json", self.ignore_list)
+                await self.save_ignore_list()
                 await self.bot.say("Channel added to ignore list.")
             else:
                 await self.bot.say("Channel already in ignore list.")
@@ -1075,9 +1935,9 @@ class Mod:
     async def ignore_server(self, ctx):
         """Ignores current server"""
         server = ctx.message.server
-        if server.id not in self.ignore_list["SERVERS"]:
+        if server.id not in self.ignored_servers:
             self.ignore_list["SERVERS"].append(server.id)
-            dataIO.save_json("data/mod/ignorelist.json", self.ignore_list)
+            await self.save_ignore_list()
             await self.bot.say("This server has been added to the ignore list.")
         else:
             await self.bot.say("This server is already being ignored.")
@@ -1097,16 +1957,16 @@ class Mod:
         Defaults to current one"""
         current_ch = ctx.message.channel
         if not channel:
-            if current_ch.id in self.ignore_list["CHANNELS"]:
+            if current_ch.id in self.ignored_channels:
                 self.ignore_list["CHANNELS"].remove(current_ch.id)
-                dataIO.save_json("data/mod/ignorelist.json", self.ignore_list)
+                await self.save_ignore_list()
                 await self.bot.say("This channel has been removed from the ignore list.")
             else:
                 await self.bot.say("This channel is not in the ignore list.")
         else:
-            if channel.id in self.ignore_list["CHANNELS"]:
+            if channel.id in self.ignored_channels:
                 self.ignore_list["CHANNELS"].remove(channel.id)
-                dataIO.save_json("data/mod/ignorelist.json", self.ignore_list)
+                await self.save_ignore_list()
                 await self.bot.say("Channel removed from ignore list.")
             else:
                 await self.bot.say("That channel is not in the ignore list.")
@@ -1115,9 +1975,9 @@ class Mod:
     async def unignore_server(self, ctx):
         """Removes current server from ignore list"""
         server = ctx.message.server
-        if server.id in self.ignore_list["SERVERS"]:
+        if server.id in self.ignored_servers:
             self.ignore_list["SERVERS"].remove(server.id)
-            dataIO.save_json("data/mod/ignorelist.json", self.ignore_list)
+            await self.save_ignore_list()
             await self.bot.say("This server has been removed from the ignore list.")
         else:
             await self.bot.say("This server is not in the ignore list.")
@@ -1135,7 +1995,9 @@ class Mod:
 
         Use double quotes to add/remove sentences
         Using this command with no subcommands will send
-        the list of the server's filtered words."""
+        the list of the server's filtered words.
+        Whole word and regex entries are listed and removed
+        with their word: and regex: prefix."""
         if ctx.invoked_subcommand is None:
             await send_cmd_help(ctx)
             server = ctx.message.server
@@ -1170,11 +2032,59 @@ class Mod:
                 self.filter[server.id].append(w.lower())
                 added += 1
         if added:
-            dataIO.save_json("data/mod/filter.json", self.filter)
+            await self.save_filter(server)
             await self.bot.say("Words added to filter.")
         else:
             await self.bot.say("Words already in the filter.")
 
+    @_filter.command(name="addword", pass_context=True)
+    async def filter_addword(self, ctx, *words: str):
+        """Adds whole words to the filter
+
+        Unlike filter add, they won't match inside other words
+        Example:
+        filter addword ass"""
+        if words == ():
+            await send_cmd_help(ctx)
+            return
+        server = ctx.message.server
+        added = 0
+        if server.id not in self.filter.keys():
+            self.filter[server.id] = []
+        for w in words:
+            entry = WordFilter.WORD + w.lower()
+            if entry not in self.filter[server.id] and w != "":
+                self.filter[server.id].append(entry)
+                added += 1
+        if added:
+            await self.save_filter(server)
+            await self.bot.say("Words added to filter.")
+        else:
+            await self.bot.say("Words already in the filter.")
+
+    @_filter.command(name="addregex", pass_context=True)
+    async def filter_addregex(self, ctx, *, pattern: str):
+        """Adds a regular expression to the filter
+
+        Matching is case insensitive
+        Example:
+        filter addregex disc(or)?d\.gg/\w+"""
+        server = ctx.message.server
+        try:
+            re.compile(pattern)
+        except re.error as e:
+            await self.bot.say("Invalid regex: {}".format(e))
+            return
+        entry = WordFilter.REGEX + pattern
+        if server.id not in self.filter.keys():
+            self.filter[server.id] = []
+        if entry in self.filter[server.id]:
+            await self.bot.say("Regex already in the filter.")
+            return
+        self.filter[server.id].append(entry)
+        await self.save_filter(server)
+        await self.bot.say("Regex added to filter.")
+
     @_filter.command(name="remove", pass_context=True)
     async def filter_remove(self, ctx, *words: str):
         """Remove words from the filter
@@ -1192,11 +2102,14 @@ class Mod:
             await self.bot.say("There are no filtered words in this server.")
             return
         for w in words:
-            if w.lower() in self.filter[server.id]:
-                self.filter[server.id].remove(w.lower())
+            # Regex entries are case sensitive
+            if not w.startswith(WordFilter.REGEX):
+                w = w.lower()
+            if w in self.filter[server.id]:
+                self.filter[server.id].remove(w)
                 removed += 1
         if removed:
-            dataIO.save_json("data/mod/filter.json", self.filter)
+            await self.save_filter(server)
             await self.bot.say("Words removed from filter.")
         else:
             await self.bot.say("Those words weren't in the filter.")
@@ -1258,12 +2171,9 @@ class Mod:
     async def names(self, user : discord.Member):
         """Show previous names/nicknames of a user"""
         server = user.server
-        names = self.past_names[user.id] if user.id in self.past_names else None
-        try:
-            nicks = self.past_nicknames[server.id][user.id]
-            nicks = [escape_mass_mentions(nick) for nick in nicks]
-        except:
-            nicks = None
+        names = await self.name_history.get_names(user.id)
+        nicks = await self.name_history.get_nicknames(server.id, user.id)
+        nicks = [escape_mass_mentions(nick) for nick in nicks]
         msg = ""
         if names:
             names = [escape_mass_mentions(name) for name in names]
@@ -1280,23 +2190,6 @@ class Mod:
             await self.bot.say("That user doesn't have any recorded name or "
                                "nickname change.")
 
-    async def mass_purge(self, messages):
-        while messages:
-            if len(messages) > 1:
-                await self.bot.delete_messages(messages[:100])
-                messages = messages[100:]
-            else:
-                await self.bot.delete_message(messages[0])
-                messages = []
-            await asyncio.sleep(1.5)
-
-    async def slow_deletion(self, messages):
-        for message in messages:
-            try:
-                await self.bot.delete_message(message)
-            except:
-                pass
-
     def is_admin_or_superior(self, obj):
         if isinstance(obj, discord.Message):
             user = obj.author
@@ -1331,20 +2224,17 @@ class Mod:
             raise TypeError('Only messages, members or roles may be passed')
 
         server = obj.server
-        admin_role = settings.get_server_admin(server)
-        mod_role = settings.get_server_mod(server)
+        admin_ids, mod_ids = settings.get_role_ids(server)
 
         if isinstance(obj, discord.Role):
-            return obj.name in [admin_role, mod_role]
+            return obj.id in admin_ids or obj.id in mod_ids
 
         if user.id == settings.owner:
             return True
-        elif discord.utils.get(user.roles, name=admin_role):
-            return True
-        elif discord.utils.get(user.roles, name=mod_role):
-            return True
-        else:
-            return False
+        for role in user.roles:
+            if role.id in admin_ids or role.id in mod_ids:
+                return True
+        return False
 
     def is_allowed_by_hierarchy(self, server, mod, user):
         toggled = self.settings[server.id].get("respect_hierarchy",
@@ -1365,13 +2255,10 @@ class Mod:
         if mod_channel is None:
             return
 
-        if server.id not in self.cases:
-            self.cases[server.id] = {}
-
-        case_n = len(self.cases[server.id]) + 1
+        server_cases = self.modlog[server.id]
 
         case = {
-            "case"         : case_n,
+            "case"         : None,  # Assigned by add
             "created"      : datetime.utcnow().timestamp(),
             "modified"     : None,
             "action"       : action,
@@ -1387,20 +2274,8 @@ class Mod:
             "until"        : None,
         }
 
-        case_msg = self.format_case_msg(case)
-
-        try:
-            msg = await self.bot.send_message(mod_channel, case_msg)
-            case["message"] = msg.id
-        except:
-            pass
-
-        self.cases[server.id][str(case_n)] = case
-
-        if mod:
-            self.last_case[server.id][mod.id] = case_n
-
-        dataIO.save_json("data/mod/modlog.json", self.cases)
+        server_cases.add(case, mod=mod)
+        self.modlog_outbox.post(mod_channel, server_cases, case)
 
     async def update_case(self, server, *, case, mod=None, reason=None,
                           until=False):
@@ -1408,8 +2283,8 @@ class Mod:
         if channel is None:
             raise NoModLogChannel()
 
-        case = str(case)
-        case = self.cases[server.id][case]
+        server_cases = self.modlog[server.id]
+        case = server_cases.get(case)
 
         if case["moderator_id"] is not None:
             if case["moderator_id"] != mod.id:
@@ -1419,8 +2294,7 @@ class Mod:
                 else:
                     raise UnauthorizedCaseEdit()
         else:
-            case["moderator"] = str(mod)
-            case["moderator_id"] = mod.id
+            server_cases.set_moderator(case, mod)
 
         if case["reason"]:  # Existing reason
             case["modified"] = datetime.utcnow().timestamp()
@@ -1429,23 +2303,39 @@ class Mod:
         if until is not False:
             case["until"] = until
 
-        case_msg = self.format_case_msg(case)
+        server_cases.changed(case)
+        case_msg = server_cases.render(case, self.format_case_msg)
 
-        dataIO.save_json("data/mod/modlog.json", self.cases)
+        server_cases.save(case)
 
-        if case["message"] is None:  # The case's message was never sent
-            raise CaseMessageNotFound()
+        if case["message"] is None:
+            if self.modlog_outbox.is_pending(server, case):
+                return  # It will be sent with the new reason
+            raise CaseMessageNotFound()  # The case's message was never sent
+
+        # Several cases can share a message
+        shared = server_cases.by_message(case["message"])
+        if len(shared) > 1:
+            case_msg = "\n".join(server_cases.render(c, self.format_case_msg)
+                                 for c in shared)
 
+        # Edited by ID, there's no need to fetch the message first
         try:
-            msg = await self.bot.get_message(channel, case["message"])
+            await self.bot.http.edit_message(case["message"], channel.id,
+                                             case_msg)
         except discord.NotFound:
             raise CaseMessageNotFound()
         except discord.Forbidden:
             raise NoModLogAccess()
-        else:
-            await self.bot.edit_message(msg, case_msg)
 
 
+    def format_case_summary(self, case):
+        action = ACTIONS_REPR.get(case["action"], (case["action"],))[0]
+        created = datetime.utcfromtimestamp(case["created"])
+        return "#{} {} | {} | {} | by {}: {}".format(
+            case["case"], created.strftime("%Y-%m-%d"), action, case["user"],
+            case["moderator"] or "Unknown", case["reason"] or "No reason")
+
     def format_case_msg(self, case):
         tmp = case.copy()
         if case["reason"] is None:
@@ -1493,19 +2383,36 @@ class Mod:
 
         return case_msg
 
+    async def save_filter(self, server):
+        self._word_filters.pop(server.id, None)
+        await dataIO.save_json_async("data/mod/filter.json", self.filter)
+
+    def get_word_filter(self, server):
+        """Returns the server's compiled filter, None if it's empty"""
+        try:
+            return self._word_filters[server.id]
+        except KeyError:
+            pass
+        entries = self.filter.get(server.id)
+        word_filter = WordFilter(entries) if entries else None
+        self._word_filters[server.id] = word_filter
+        return word_filter
+
     async def check_filter(self, message):
         server = message.server
-        if server.id in self.filter.keys():
-            for w in self.filter[server.id]:
-                if w in message.content.lower():
-                    try:
-                        await self.bot.delete_message(message)
-                        logger.info("Message deleted in server {}."
-                                    "Filtered: {}"
-                                    "".format(server.id, w))
-                        return True
-                    except:
-                        pass
+        word_filter = self.get_word_filter(server)
+        if word_filter is None:
+            return False
+        w = word_filter.search(message.content)
+        if w is not None:
+            try:
+                await self.bot.delete_message(message)
+                logger.info("Message deleted in server {}."
+                            "Filtered: {}"
+                            "".format(server.id, w))
+                return True
+            except:
+                pass
         return False
 
     async def check_duplicates(self, message):
@@ -1516,14 +2423,10 @@ class Mod:
         if self.settings[server.id]["delete_repeats"]:
             if not message.content:
                 return False
-            if author.id not in self.cache:
-                self.cache[author.id] = deque(maxlen=3)
-            self.cache.move_to_end(author.id)
-            while len(self.cache) > 100000:
-                self.cache.popitem(last=False) # the oldest gets discarded
-            self.cache[author.id].append(message.content)
-            msgs = self.cache[author.id]
-            if len(msgs) == 3 and msgs[0] == msgs[1] == msgs[2]:
+            settings = self.settings[server.id]
+            if self.repeats.check(server.id, author.id, message.content,
+                                  settings.get("repeat_count", 3),
+                                  settings.get("repeat_window", 0)):
                 try:
                     await self.bot.delete_message(message)
                     return True
@@ -1582,15 +2485,9 @@ class Mod:
         await asyncio.sleep(delay)
         await _delete_helper(self.bot, message)
 
-    async def on_message(self, message):
-        author = message.author
-        if message.server is None or self.bot.user == author:
-            return
-
-        valid_user = isinstance(author, discord.Member) and not author.bot
-
+    async def check_message(self, message, info):
         #  Bots and mods or superior are ignored from the filter
-        if not valid_user or self.is_mod_or_superior(message):
+        if not isinstance(message.author, discord.Member) or info.is_mod:
             return
 
         deleted = await self.check_filter(message)
@@ -1626,29 +2523,11 @@ class Mod:
 
     async def check_names(self, before, after):
         if before.name != after.name:
-            if before.id not in self.past_names:
-                self.past_names[before.id] = [after.name]
-            else:
-                if after.name not in self.past_names[before.id]:
-                    names = deque(self.past_names[before.id], maxlen=20)
-                    names.append(after.name)
-                    self.past_names[before.id] = list(names)
-            dataIO.save_json("data/mod/past_names.json", self.past_names)
+            self.name_history.add_name(before.id, after.name)
 
         if before.nick != after.nick and after.nick is not None:
             server = before.server
-            if server.id not in self.past_nicknames:
-                self.past_nicknames[server.id] = {}
-            if before.id in self.past_nicknames[server.id]:
-                nicks = deque(self.past_nicknames[server.id][before.id],
-                              maxlen=20)
-            else:
-                nicks = []
-            if after.nick not in nicks:
-                nicks.append(after.nick)
-                self.past_nicknames[server.id][before.id] = list(nicks)
-                dataIO.save_json("data/mod/past_nicknames.json",
-                                 self.past_nicknames)
+            self.name_history.add_nickname(server.id, before.id, after.nick)
 
     def are_overwrites_empty(self, overwrites):
         """There is currently no cleaner way to check if a
@@ -1693,10 +2572,7 @@ def check_files():
     files = {
         "ignorelist.json"     : ignore_list,
         "filter.json"         : {},
-        "past_names.json"     : {},
-        "past_nicknames.json" : {},
         "settings.json"       : {},
-        "modlog.json"         : {},
         "perms_cache.json"    : {}
     }
 
@@ -5,6 +5,7 @@ from cogs.utils.converters import GlobalUser
 from __main__ import set_cog
 from .utils.dataIO import dataIO
 from .utils.chat_formatting import pagify, box
+from .utils.settings import STORAGE_ENGINES
 
 import importlib
 import traceback
@@ -47,6 +48,8 @@ class Owner:
         self.setowner_lock = False
         self.disabled_commands = dataIO.load_json("data/red/disabled_commands.json")
         self.global_ignores = dataIO.load_json("data/red/global_ignores.json")
+        self.blacklist_ids = set(self.global_ignores["blacklist"])
+        self.whitelist_ids = set(self.global_ignores["whitelist"])
         self.session = aiohttp.ClientSession(loop=self.bot.loop)
 
     def __unload(self):
@@ -506,6 +509,36 @@ class Owner:
             await self.bot.say("Token set. Restart me.")
             log.debug("Token changed.")
 
+    @_set.command(name="storage")
+    @checks.is_owner()
+    async def _storage(self, engine: str):
+        """Sets where mod-log cases, name history and the bank are stored
+
+        json: the default, JSON files in each cog's data folder
+        sqlite: a single SQLite database, data/red/storage.db
+
+        The JSON data is moved to SQLite when the mod and economy
+        cogs are next loaded. From then on the JSON files aren't
+        updated anymore, so switching back isn't supported."""
+        engine = engine.lower()
+        current = self.bot.settings.storage
+        if engine not in STORAGE_ENGINES:
+            await self.bot.say("The storage engine must be one of: {}"
+                               "".format(", ".join(STORAGE_ENGINES)))
+        elif engine == current:
+            await self.bot.say("That storage engine is already in use.")
+        elif current == "sqlite":
+            await self.bot.say("The JSON files haven't been kept up to date "
+                               "since the data was moved to SQLite. "
+                               "Switching back isn't supported.")
+        else:
+            self.bot.settings.storage = engine
+            self.bot.settings.save_settings()
+            await self.bot.say("Storage engine set to {}. Reload the mod and "
+                               "economy cogs or restart me to move their "
+                               "data.".format(engine))
+            log.debug("Storage engine changed to {}.".format(engine))
+
     @_set.command(name="adminrole", pass_context=True, no_pm=True)
     @checks.serverowner()
     async def _server_adminrole(self, ctx, *, role: discord.Role):
@@ -538,7 +571,7 @@ class Owner:
     @blacklist.command(name="add")
     async def _blacklist_add(self, user: GlobalUser):
         """Adds user to Red's global blacklist"""
-        if user.id not in self.global_ignores["blacklist"]:
+        if user.id not in self.blacklist_ids:
             self.global_ignores["blacklist"].append(user.id)
             self.save_global_ignores()
             await self.bot.say("User has been blacklisted.")
@@ -548,7 +581,7 @@ class Owner:
     @blacklist.command(name="remove")
     async def _blacklist_remove(self, user: GlobalUser):
         """Removes user from Red's global blacklist"""
-        if user.id in self.global_ignores["blacklist"]:
+        if user.id in self.blacklist_ids:
             self.global_ignores["blacklist"].remove(user.id)
             self.save_global_ignores()
             await self.bot.say("User has been removed from the blacklist.")
@@ -586,7 +619,7 @@ class Owner:
     @whitelist.command(name="add")
     async def _whitelist_add(self, user: GlobalUser):
         """Adds user to Red's global whitelist"""
-        if user.id not in self.global_ignores["whitelist"]:
+        if user.id not in self.whitelist_ids:
             if not self.global_ignores["whitelist"]:
                 msg = "\nNon-whitelisted users will be ignored."
             else:
@@ -600,7 +633,7 @@ class Owner:
     @whitelist.command(name="remove")
     async def _whitelist_remove(self, user: GlobalUser):
         """Removes user from Red's global whitelist"""
-        if user.id in self.global_ignores["whitelist"]:
+        if user.id in self.whitelist_ids:
             self.global_ignores["whitelist"].remove(user.id)
             self.save_global_ignores()
             await self.bot.say("User has been removed from the whitelist.")
@@ -1052,6 +1085,8 @@ class Owner:
         return fmt.format(d=days, h=hours, m=minutes, s=seconds)
 
     def save_global_ignores(self):
+        self.blacklist_ids = set(self.global_ignores["blacklist"])
+        self.whitelist_ids = set(self.global_ignores["whitelist"])
         dataIO.save_json("data/red/global_ignores.json", self.global_ignores)
 
     def save_disabled_commands(self):
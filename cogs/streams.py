@@ -161,7 +161,7 @@ class Streams:
         else:
             await self.bot.say("Alert has been removed from this channel.")
 
-        dataIO.save_json("data/streams/twitch.json", self.twitch_streams)
+        await dataIO.save_json_async("data/streams/twitch.json", self.twitch_streams)
 
     @streamalert.command(name="hitbox", pass_context=True)
     async def hitbox_alert(self, ctx, stream: str):
@@ -191,7 +191,7 @@ class Streams:
         else:
             await self.bot.say("Alert has been removed from this channel.")
 
-        dataIO.save_json("data/streams/hitbox.json", self.hitbox_streams)
+        await dataIO.save_json_async("data/streams/hitbox.json", self.hitbox_streams)
 
     @streamalert.command(name="mixer", pass_context=True)
     async def mixer_alert(self, ctx, stream: str):
@@ -221,7 +221,7 @@ class Streams:
         else:
             await self.bot.say("Alert has been removed from this channel.")
 
-        dataIO.save_json("data/streams/beam.json", self.mixer_streams)
+        await dataIO.save_json_async("data/streams/beam.json", self.mixer_streams)
 
     @streamalert.command(name="picarto", pass_context=True)
     async def picarto_alert(self, ctx, stream: str):
@@ -251,7 +251,7 @@ class Streams:
         else:
             await self.bot.say("Alert has been removed from this channel.")
 
-        dataIO.save_json("data/streams/picarto.json", self.picarto_streams)
+        await dataIO.save_json_async("data/streams/picarto.json", self.picarto_streams)
 
     @streamalert.command(name="stop", pass_context=True)
     async def stop_alert(self, ctx):
@@ -277,10 +277,10 @@ class Streams:
             for s in to_delete:
                 stream_type.remove(s)
 
-        dataIO.save_json("data/streams/twitch.json", self.twitch_streams)
-        dataIO.save_json("data/streams/hitbox.json", self.hitbox_streams)
-        dataIO.save_json("data/streams/beam.json", self.mixer_streams)
-        dataIO.save_json("data/streams/picarto.json", self.picarto_streams)
+        await dataIO.save_json_async("data/streams/twitch.json", self.twitch_streams)
+        await dataIO.save_json_async("data/streams/hitbox.json", self.hitbox_streams)
+        await dataIO.save_json_async("data/streams/beam.json", self.mixer_streams)
+        await dataIO.save_json_async("data/streams/picarto.json", self.picarto_streams)
 
         await self.bot.say("There will be no more stream alerts in this "
                            "channel.")
@@ -298,7 +298,7 @@ class Streams:
 
         https://blog.twitch.tv/client-id-required-for-kraken-api-calls-afbb8e95f843"""
         self.settings["TWITCH_TOKEN"] = token
-        dataIO.save_json("data/streams/settings.json", self.settings)
+        await dataIO.save_json_async("data/streams/settings.json", self.settings)
         await self.bot.say('Twitch Client-ID set.')
 
     @streamset.command(pass_context=True, no_pm=True)
@@ -320,7 +320,7 @@ class Streams:
         else:
             await self.bot.send_cmd_help(ctx)
 
-        dataIO.save_json("data/streams/settings.json", self.settings)
+        await dataIO.save_json_async("data/streams/settings.json", self.settings)
 
     @streamset.command(pass_context=True, no_pm=True)
     @checks.admin()
@@ -336,7 +336,7 @@ class Streams:
         else:
             await self.bot.say("Notifications won't be deleted anymore.")
 
-        dataIO.save_json("data/streams/settings.json", self.settings)
+        await dataIO.save_json_async("data/streams/settings.json", self.settings)
 
     async def hitbox_online(self, stream):
         url = "https://api.hitbox.tv/media/live/" + stream
@@ -609,10 +609,10 @@ class Streams:
                     await asyncio.sleep(0.5)
 
             if save:
-                dataIO.save_json("data/streams/twitch.json", self.twitch_streams)
-                dataIO.save_json("data/streams/hitbox.json", self.hitbox_streams)
-                dataIO.save_json("data/streams/beam.json", self.mixer_streams)
-                dataIO.save_json("data/streams/picarto.json", self.picarto_streams)
+                await dataIO.save_json_async("data/streams/twitch.json", self.twitch_streams)
+                await dataIO.save_json_async("data/streams/hitbox.json", self.hitbox_streams)
+                await dataIO.save_json_async("data/streams/beam.json", self.mixer_streams)
+                await dataIO.save_json_async("data/streams/picarto.json", self.picarto_streams)
 
             await asyncio.sleep(CHECK_DELAY)
 
@@ -653,7 +653,7 @@ class Streams:
         # We might as well delete the invalid / renamed ones
         self.twitch_streams = [s for s in self.twitch_streams if "ID" in s]
 
-        dataIO.save_json("data/streams/twitch.json", self.twitch_streams)
+        await dataIO.save_json_async("data/streams/twitch.json", self.twitch_streams)
 
 
 def check_folders():
@@ -27,6 +27,11 @@ class Trivia:
         self.file_path = "data/trivia/settings.json"
         settings = dataIO.load_json(self.file_path)
         self.settings = defaultdict(lambda: DEFAULTS.copy(), settings)
+        bot.add_message_handler(self.check_trivia_answer, bots=True,
+                                check=lambda m: bool(self.trivia_sessions))
+
+    def __unload(self):
+        self.bot.remove_message_handler(self.check_trivia_answer)
 
     @commands.group(pass_context=True, no_pm=True)
     @checks.mod_or_permissions(administrator=True)
@@ -188,11 +193,10 @@ class Trivia:
                 return t
         return None
 
-    async def on_message(self, message):
-        if message.author != self.bot.user:
-            session = self.get_trivia_by_channel(message.channel)
-            if session:
-                await session.check_answer(message)
+    async def check_trivia_answer(self, message, info):
+        session = self.get_trivia_by_channel(message.channel)
+        if session:
+            await session.check_answer(message)
 
     async def on_trivia_end(self, instance):
         if instance in self.trivia_sessions:
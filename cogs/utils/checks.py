@@ -49,20 +49,34 @@ def role_or_permissions(ctx, check, **perms):
     role = discord.utils.find(check, author.roles)
     return role is not None
 
+def role_ids_or_permissions(ctx, role_ids, **perms):
+    if check_permissions(ctx, perms):
+        return True
+
+    ch = ctx.message.channel
+    author = ctx.message.author
+    if ch.is_private or not role_ids:
+        return False # can't have roles in PMs
+
+    return not role_ids.isdisjoint([r.id for r in author.roles])
+
 def mod_or_permissions(**perms):
     def predicate(ctx):
         server = ctx.message.server
-        mod_role = settings.get_server_mod(server).lower()
-        admin_role = settings.get_server_admin(server).lower()
-        return role_or_permissions(ctx, lambda r: r.name.lower() in (mod_role,admin_role), **perms)
+        if server is None:
+            return check_permissions(ctx, perms)
+        admin_ids, mod_ids = settings.get_role_ids(server, ignore_case=True)
+        return role_ids_or_permissions(ctx, admin_ids | mod_ids, **perms)
 
     return commands.check(predicate)
 
 def admin_or_permissions(**perms):
     def predicate(ctx):
         server = ctx.message.server
-        admin_role = settings.get_server_admin(server)
-        return role_or_permissions(ctx, lambda r: r.name.lower() == admin_role.lower(), **perms)
+        if server is None:
+            return check_permissions(ctx, perms)
+        admin_ids, _ = settings.get_role_ids(server, ignore_case=True)
+        return role_ids_or_permissions(ctx, admin_ids, **perms)
 
     return commands.check(predicate)
 
@@ -1,56 +1,270 @@
+import asyncio
 import json
 import os
 import logging
+import zlib
+import concurrent.futures
+from concurrent.futures import ThreadPoolExecutor
 from random import randint
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+PROFILES = ("pretty", "compact")
+
 class InvalidFileIO(Exception):
     pass
 
 class DataIO():
     def __init__(self):
         self.logger = logging.getLogger("red")
+        self.flush_interval = 5  # seconds
+        self._pending = {}
+        self._flush_handle = None
+        self._executor = None
+        self._writes = {}
+        self.default_profile = "pretty"
+        self._profiles = {}
 
     def save_json(self, filename, data):
         """Atomically saves json file"""
+        self._pending.pop(filename, None)  # This write supersedes it
+        return self._save_in_order(filename, data)
+
+    def _save_in_order(self, filename, data):
+        prepared = self._prepare(filename, data)
+        if self._is_writing(filename):
+            # Queued behind the older writes of the same file
+            future = self._submit(filename, self._write, filename, prepared)
+            return future.result()
+        return self._write(filename, prepared)
+
+    def _prepare(self, filename, data):
+        """Returns what the writer needs to save data, taken on the loop
+
+        Indented json is produced by the pure Python encoder, so for
+        the pretty profile only a snapshot of the containers is taken
+        here and serializing is left to the writer. The compact profile
+        is serialized right away: its C encoders are faster than
+        copying the data would be"""
+        if self.get_profile(filename) == "compact":
+            return _dumps(data)
+        return _snapshot(data)
+
+    def _write(self, filename, prepared):
+        if isinstance(prepared, bytes):
+            payload = prepared
+        else:
+            payload = json.dumps(prepared, indent=4, sort_keys=True,
+                                 separators=(',', ' : ')).encode("utf-8")
         rnd = randint(1000, 9999)
         path, ext = os.path.splitext(filename)
         tmp_file = "{}-{}.tmp".format(path, rnd)
-        self._save_json(tmp_file, data)
         try:
-            self._read_json(tmp_file)
-        except json.decoder.JSONDecodeError:
-            self.logger.exception("Attempted to write file {} but JSON "
-                                  "integrity check on tmp file has failed. "
-                                  "The original file is unaltered."
-                                  "".format(filename))
+            if self.get_profile(filename) == "compact":
+                return self._save_compact(filename, tmp_file, payload)
+            with open(tmp_file, mode="wb") as f:
+                f.write(payload)
+            try:
+                self._read_json(tmp_file)
+            except json.decoder.JSONDecodeError:
+                self.logger.exception("Attempted to write file {} but JSON "
+                                      "integrity check on tmp file has "
+                                      "failed. The original file is "
+                                      "unaltered.".format(filename))
+                return False
+            os.replace(tmp_file, filename)
+            return True
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+    def set_profile(self, filename, profile):
+        """Sets the storage profile used for a file
+
+        pretty: indented and sorted, verified by parsing it back
+        compact: minimal separators, unsorted, orjson or ujson are used
+                 if available. Verified by length and checksum, which
+                 are also stored alongside the file
+
+        Files without a profile use default_profile"""
+        if profile not in PROFILES:
+            raise InvalidFileIO("Unknown storage profile: {}".format(profile))
+        self._profiles[filename] = profile
+
+    def get_profile(self, filename):
+        return self._profiles.get(filename, self.default_profile)
+
+    def save_json_deferred(self, filename, data):
+        """Schedules json file to be saved on the next flush
+
+        Saves of the same file issued before the flush are coalesced
+        into a single write of the most recently passed data. Pending
+        files are written every flush_interval seconds and when the
+        bot shuts down. Use flush() to force them to disk"""
+        self._pending[filename] = data
+        if self._flush_handle is not None:
+            return
+        try:
+            loop = asyncio.get_event_loop()
+            self._flush_handle = loop.call_later(self.flush_interval,
+                                                 self._scheduled_flush)
+        except RuntimeError:  # No usable loop, write it right away
+            self.flush(filename)
+
+    def flush(self, filename=None):
+        """Writes pending deferred saves to disk
+
+        If filename is passed only that file is flushed. Writes already
+        queued in the writer thread are waited for as well.
+        Returns False if any of the writes failed"""
+        if filename is not None:
+            to_flush = [filename] if filename in self._pending else []
+            to_wait = [filename]
+        else:
+            to_flush = list(self._pending)
+            to_wait = None
+
+        success = True
+        for f in to_flush:
+            data = self._pending.pop(f)
+            try:
+                success = self._save_in_order(f, data) and success
+            except Exception:
+                self.logger.exception("Deferred save of {} has failed."
+                                      "".format(f))
+                success = False
+        if to_wait is None:
+            to_wait = list(self._writes)
+        for f in to_wait:
+            success = self._wait_for_writes(f) and success
+        return success
+
+    def save_json_async(self, filename, data):
+        """Atomically saves json file in the writer thread
+
+        A snapshot of the data is taken right away, so it can be
+        modified as soon as this returns. Serialization of the pretty
+        profile and file I/O happen off the event loop and writes are
+        executed in the order they were requested.
+        Returns an awaitable resolving to the same value as save_json.
+        The write is queued even if the result is never awaited"""
+        self._pending.pop(filename, None)
+        prepared = self._prepare(filename, data)
+        future = self._submit(filename, self._threaded_write,
+                              filename, prepared)
+        return asyncio.wrap_future(future)
+
+    def load_json_async(self, filename):
+        """Loads json file in the writer thread
+
+        Being queued after any pending write, it always returns
+        the most recently saved data.
+        Returns an awaitable resolving to the loaded data"""
+        if filename in self._pending:
+            self.save_json_async(filename, self._pending.pop(filename))
+        future = self._submit(None, self._read_json, filename)
+        return asyncio.wrap_future(future)
+
+    def _submit(self, filename, func, *args):
+        if self._executor is None:
+            # A single worker keeps the writes to each path in order
+            self._executor = ThreadPoolExecutor(max_workers=1)
+        future = self._executor.submit(func, *args)
+        if filename is not None:
+            self._writes[filename] = future
+        return future
+
+    def _is_writing(self, filename):
+        future = self._writes.get(filename)
+        if future is None:
+            return False
+        if future.done():
+            del self._writes[filename]
             return False
-        os.replace(tmp_file, filename)
         return True
 
+    def _wait_for_writes(self, filename):
+        """Returns False if the last queued write of filename failed"""
+        future = self._writes.pop(filename, None)
+        if future is None:
+            return True
+        concurrent.futures.wait([future])
+        return future.exception() is None and future.result() is not False
+
+    def _threaded_write(self, filename, prepared):
+        try:
+            return self._write(filename, prepared)
+        except Exception:
+            self.logger.exception("Threaded save of {} has failed."
+                                  "".format(filename))
+            return False
+
+    def _scheduled_flush(self):
+        self._flush_handle = None
+        for filename in list(self._pending):
+            self.save_json_async(filename, self._pending[filename])
+
     def load_json(self, filename):
         """Loads json file"""
+        self.flush(filename)
+        self._wait_for_writes(filename)
         return self._read_json(filename)
 
     def is_valid_json(self, filename):
         """Verifies if json file exists / is readable"""
+        self.flush(filename)
+        self._wait_for_writes(filename)
+        if self._checksum_matches(filename):
+            return True
         try:
             self._read_json(filename)
             return True
         except FileNotFoundError:
             return False
-        except json.decoder.JSONDecodeError:
+        except ValueError:  # Decoding errors of every json backend
             return False
 
     def _read_json(self, filename):
+        if self.get_profile(filename) == "compact":
+            with open(filename, mode="rb") as f:
+                return _loads(f.read())
         with open(filename, encoding='utf-8', mode="r") as f:
             data = json.load(f)
         return data
 
-    def _save_json(self, filename, data):
-        with open(filename, encoding='utf-8', mode="w") as f:
-            json.dump(data, f, indent=4,sort_keys=True,
-                separators=(',',' : '))
-        return data
+    def _save_compact(self, filename, tmp_file, payload):
+        checksum = (len(payload), zlib.crc32(payload))
+        with open(tmp_file, mode="wb") as f:
+            f.write(payload)
+        with open(tmp_file, mode="rb") as f:
+            written = f.read()
+        if (len(written), zlib.crc32(written)) != checksum:
+            self.logger.error("Attempted to write file {} but the checksum "
+                              "of the tmp file doesn't match. The original "
+                              "file is unaltered.".format(filename))
+            return False
+        os.replace(tmp_file, filename)
+        with open(filename + ".crc", mode="w") as f:
+            f.write("{} {}".format(*checksum))
+        return True
+
+    def _checksum_matches(self, filename):
+        try:
+            with open(filename + ".crc", mode="r") as f:
+                length, crc = map(int, f.read().split())
+            with open(filename, mode="rb") as f:
+                payload = f.read()
+        except (OSError, ValueError):
+            return False
+        return (len(payload), zlib.crc32(payload)) == (length, crc)
 
     def _legacy_fileio(self, filename, IO, data=None):
         """Old fileIO provided for backwards compatibility"""
@@ -64,6 +278,36 @@ class DataIO():
             raise InvalidFileIO("FileIO was called with invalid"
                 " parameters")
 
+_SCALARS = (str, int, float, bool, type(None))
+
+def _snapshot(data):
+    """Copies the containers of json data, the values are shared"""
+    if isinstance(data, dict):
+        return {k: v if isinstance(v, _SCALARS) else _snapshot(v)
+                for k, v in data.items()}
+    elif isinstance(data, (list, tuple)):
+        return [v if isinstance(v, _SCALARS) else _snapshot(v)
+                for v in data]
+    return data
+
+def _dumps(data):
+    if orjson is not None:
+        try:
+            return orjson.dumps(data)
+        except TypeError:  # e.g. non-str keys, json handles those
+            pass
+    elif ujson is not None:
+        return ujson.dumps(data, ensure_ascii=False).encode("utf-8")
+    return json.dumps(data, ensure_ascii=False,
+                      separators=(',', ':')).encode("utf-8")
+
+def _loads(payload):
+    if orjson is not None:
+        return orjson.loads(payload)
+    elif ujson is not None:
+        return ujson.loads(payload.decode("utf-8"))
+    return json.loads(payload.decode("utf-8"))
+
 def get_value(filename, key):
     with open(filename, encoding='utf-8', mode="r") as f:
         data = json.load(f)
@@ -1,11 +1,19 @@
 from .dataIO import dataIO
 from copy import deepcopy
+from collections import OrderedDict
+from types import MappingProxyType
 import discord
 import os
+import re
 import argparse
 
 
 default_path = "data/red/settings.json"
+STORAGE_ENGINES = ("json", "sqlite")
+
+
+def _no_prefix(content):
+    return None
 
 
 class Settings:
@@ -19,15 +27,19 @@ class Settings:
             "PASSWORD": None,
             "OWNER": None,
             "PREFIXES": [],
+            "STORAGE": "json",
             "default": {"ADMIN_ROLE": "Transistor",
                         "MOD_ROLE": "Process",
                         "PREFIXES": []}
                         }
         self._memory_only = False
+        self._prefix_matchers = {}
+        self._message_prefixes = OrderedDict()
+        self._role_ids = {}
 
         if not dataIO.is_valid_json(self.path):
             self.bot_settings = deepcopy(self.default_settings)
-            self.save_settings()
+            dataIO.save_json(self.path, self.bot_settings)
         else:
             current = dataIO.load_json(self.path)
             if current.keys() != self.default_settings.keys():
@@ -44,6 +56,9 @@ class Settings:
 
         if "LOGIN_TYPE" in self.bot_settings:
             self.update_old_settings_v2()
+
+        self._servers = {sid: data for sid, data in self.bot_settings.items()
+                         if str(sid).isdigit()}
         if parse_args:
             self.parse_cmd_arguments()
 
@@ -117,8 +132,16 @@ class Settings:
                 os.makedirs(folder)
 
     def save_settings(self):
+        """Marks the settings as changed
+
+        Changes made in a short time span are written to disk
+        together, see flush to write them right away"""
         if not self._memory_only:
-            dataIO.save_json(self.path, self.bot_settings)
+            dataIO.save_json_deferred(self.path, self.bot_settings)
+
+    def flush(self):
+        """Writes pending changes to disk"""
+        return dataIO.flush(self.path)
 
     def update_old_settings_v1(self):
         # This converts the old settings format
@@ -192,6 +215,17 @@ class Settings:
         else:
             return tuple()
 
+    @property
+    def storage(self):
+        """Storage engine of the mod-log, name history and bank"""
+        return self.bot_settings.get("STORAGE", "json")
+
+    @storage.setter
+    def storage(self, value):
+        if value not in STORAGE_ENGINES:
+            raise ValueError("Unknown storage engine: {}".format(value))
+        self.bot_settings["STORAGE"] = value
+
     @property
     def prefixes(self):
         return self.bot_settings["PREFIXES"]
@@ -200,6 +234,7 @@ class Settings:
     def prefixes(self, value):
         assert isinstance(value, list)
         self.bot_settings["PREFIXES"] = value
+        self._invalidate_prefixes()
 
     @property
     def default_admin(self):
@@ -212,6 +247,7 @@ class Settings:
         if "default" not in self.bot_settings:
             self.update_old_settings()
         self.bot_settings["default"]["ADMIN_ROLE"] = value
+        self.invalidate_role_ids()
 
     @property
     def default_mod(self):
@@ -224,76 +260,155 @@ class Settings:
         if "default" not in self.bot_settings:
             self.update_old_settings_v1()
         self.bot_settings["default"]["MOD_ROLE"] = value
+        self.invalidate_role_ids()
 
     @property
     def servers(self):
-        ret = {}
-        server_ids = list(
-            filter(lambda x: str(x).isdigit(), self.bot_settings))
-        for server in server_ids:
-            ret.update({server: self.bot_settings[server]})
-        return ret
+        """Read-only view of the per-server settings, by server ID"""
+        return MappingProxyType(self._servers)
 
     def get_server(self, server):
+        """Returns a read-only view of the server's settings"""
         if server is None:
-            return self.bot_settings["default"].copy()
+            return MappingProxyType(self.bot_settings["default"])
         assert isinstance(server, discord.Server)
-        return self.bot_settings.get(server.id,
-                                     self.bot_settings["default"]).copy()
+        return MappingProxyType(self._servers.get(
+            server.id, self.bot_settings["default"]))
 
     def get_server_admin(self, server):
         if server is None:
             return self.default_admin
         assert isinstance(server, discord.Server)
-        if server.id not in self.bot_settings:
+        if server.id not in self._servers:
             return self.default_admin
-        return self.bot_settings[server.id].get("ADMIN_ROLE", "")
+        return self._servers[server.id].get("ADMIN_ROLE", "")
 
     def set_server_admin(self, server, value):
-        if server is None:
-            return
-        assert isinstance(server, discord.Server)
-        if server.id not in self.bot_settings:
-            self.add_server(server.id)
-        self.bot_settings[server.id]["ADMIN_ROLE"] = value
-        self.save_settings()
+        if self._update_server(server, "ADMIN_ROLE", value):
+            self.invalidate_role_ids(server)
 
     def get_server_mod(self, server):
         if server is None:
             return self.default_mod
         assert isinstance(server, discord.Server)
-        if server.id not in self.bot_settings:
+        if server.id not in self._servers:
             return self.default_mod
-        return self.bot_settings[server.id].get("MOD_ROLE", "")
+        return self._servers[server.id].get("MOD_ROLE", "")
 
     def set_server_mod(self, server, value):
-        if server is None:
-            return
-        assert isinstance(server, discord.Server)
-        if server.id not in self.bot_settings:
-            self.add_server(server.id)
-        self.bot_settings[server.id]["MOD_ROLE"] = value
-        self.save_settings()
+        if self._update_server(server, "MOD_ROLE", value):
+            self.invalidate_role_ids(server)
 
     def get_server_prefixes(self, server):
-        if server is None or server.id not in self.bot_settings:
+        if server is None or server.id not in self._servers:
             return self.prefixes
-        return self.bot_settings[server.id].get("PREFIXES", [])
+        return self._servers[server.id].get("PREFIXES", [])
 
     def set_server_prefixes(self, server, prefixes):
+        if self._update_server(server, "PREFIXES", prefixes):
+            self._invalidate_prefixes(server.id)
+
+    def _update_server(self, server, key, value):
+        """Sets a server's setting, returns False if nothing changed"""
         if server is None:
-            return
+            return False
         assert isinstance(server, discord.Server)
-        if server.id not in self.bot_settings:
-            self.add_server(server.id)
-        self.bot_settings[server.id]["PREFIXES"] = prefixes
+        data = self._servers.get(server.id)
+        if data is None:
+            data = self._add_server(server.id)
+        elif key in data and data[key] == value:
+            return False
+        data[key] = value
         self.save_settings()
+        return True
 
     def get_prefixes(self, server):
         """Returns server's prefixes if set, otherwise global ones"""
         p = self.get_server_prefixes(server)
         return p if p else self.prefixes
 
+    def match_prefix(self, server, content):
+        """Returns the prefix content starts with, or None
+
+        The longest prefix wins, as with the reverse sorted lists"""
+        key = server.id if server is not None else None
+        matcher = self._prefix_matchers.get(key)
+        if matcher is None:
+            prefixes = sorted((p for p in self.get_prefixes(server) if p),
+                              key=len, reverse=True)
+            if prefixes:
+                pattern = "|".join(re.escape(p) for p in prefixes)
+                matcher = re.compile(pattern).match
+            else:
+                matcher = _no_prefix
+            self._prefix_matchers[key] = matcher
+        match = matcher(content)
+        return match.group() if match else None
+
+    def get_message_prefix(self, message):
+        """Like match_prefix, matched once per message and content
+
+        The bot, Alias and CustomCommands all look at the same messages,
+        so recent results are kept around"""
+        key = (message.id, message.content)
+        try:
+            return self._message_prefixes[key]
+        except KeyError:
+            pass
+        prefix = self.match_prefix(message.server, message.content)
+        self._message_prefixes[key] = prefix
+        if len(self._message_prefixes) > 64:
+            self._message_prefixes.popitem(last=False)
+        return prefix
+
+    def get_role_ids(self, server, *, ignore_case=False):
+        """Returns the IDs of the server's admin and mod roles
+
+        Roles are matched by name, and resolved again only after a
+        role or the role settings change"""
+        key = (server.id, ignore_case)
+        try:
+            return self._role_ids[key]
+        except KeyError:
+            pass
+        admin = self.get_server_admin(server)
+        mod = self.get_server_mod(server)
+        if ignore_case:
+            admin, mod = admin.lower(), mod.lower()
+        admin_ids = set()
+        mod_ids = set()
+        for role in server.roles:
+            name = role.name.lower() if ignore_case else role.name
+            if name == admin:
+                admin_ids.add(role.id)
+            if name == mod:
+                mod_ids.add(role.id)
+        ids = (frozenset(admin_ids), frozenset(mod_ids))
+        self._role_ids[key] = ids
+        return ids
+
+    def invalidate_role_ids(self, server=None):
+        """Drops the resolved role IDs of server, or of every server"""
+        if server is None:
+            self._role_ids.clear()
+        else:
+            self._role_ids.pop((server.id, False), None)
+            self._role_ids.pop((server.id, True), None)
+
+    def _invalidate_prefixes(self, sid=None):
+        if sid is None:
+            self._prefix_matchers.clear()
+        else:
+            self._prefix_matchers.pop(sid, None)
+        self._message_prefixes.clear()
+
     def add_server(self, sid):
-        self.bot_settings[sid] = self.bot_settings["default"].copy()
+        self._add_server(sid)
         self.save_settings()
+
+    def _add_server(self, sid):
+        data = self.bot_settings["default"].copy()
+        self.bot_settings[sid] = self._servers[sid] = data
+        self._invalidate_prefixes(sid)
+        self.invalidate_role_ids(discord.Object(id=sid))
+        return data
@@ -0,0 +1,344 @@
+import asyncio
+import json
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+#
+# Optional SQLite storage for the data that grows the most: mod-log
+# cases, name / nickname history and bank accounts. Selected with
+# [p]set storage sqlite, the JSON layouts are used otherwise.
+#
+# The queries run in a single dedicated thread, which owns the
+# connection, so they're executed in the order they were issued.
+# Writes are fire and forget. Their data is copied into rows on the
+# calling thread, so it can keep being modified. The cogs still hold
+# their working set in memory, what changes is that each mutation
+# writes a few rows instead of rewriting a whole file.
+#
+
+DEFAULT_PATH = "data/red/storage.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+
+CREATE TABLE IF NOT EXISTS case_servers (
+    server_id TEXT PRIMARY KEY,
+    counter   INTEGER NOT NULL,
+    last_case TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS cases (
+    server_id    TEXT NOT NULL,
+    case_n       INTEGER NOT NULL,
+    user_id      TEXT,
+    moderator_id TEXT,
+    action       TEXT,
+    message      TEXT,
+    data         TEXT NOT NULL,
+    PRIMARY KEY (server_id, case_n)
+);
+CREATE INDEX IF NOT EXISTS cases_user ON cases (server_id, user_id);
+CREATE INDEX IF NOT EXISTS cases_mod ON cases (server_id, moderator_id);
+CREATE INDEX IF NOT EXISTS cases_message ON cases (server_id, message);
+
+CREATE TABLE IF NOT EXISTS names (
+    id      INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    name    TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS names_user ON names (user_id);
+
+CREATE TABLE IF NOT EXISTS nicknames (
+    id        INTEGER PRIMARY KEY AUTOINCREMENT,
+    server_id TEXT NOT NULL,
+    user_id   TEXT NOT NULL,
+    nick      TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS nicknames_user ON nicknames (server_id, user_id);
+
+CREATE TABLE IF NOT EXISTS accounts (
+    server_id  TEXT NOT NULL,
+    user_id    TEXT NOT NULL,
+    name       TEXT,
+    balance    INTEGER NOT NULL,
+    created_at TEXT,
+    PRIMARY KEY (server_id, user_id)
+);
+CREATE INDEX IF NOT EXISTS accounts_balance ON accounts (server_id, balance);
+
+CREATE TABLE IF NOT EXISTS legacy_accounts (
+    user_id TEXT PRIMARY KEY,
+    data    TEXT NOT NULL
+);
+"""
+
+
+class SQLiteStore:
+    """SQLite (WAL mode) storage engine
+
+    Loads block until the store thread has run them, like loading a
+    JSON file would. Writes return a future that can be ignored,
+    failures are logged"""
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self.logger = logging.getLogger("red")
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._conn = None
+
+    def close(self):
+        """Waits for the queued queries, then closes the connection"""
+        self._executor.submit(self._close)
+        self._executor.shutdown(wait=True)
+
+    def is_imported(self, part):
+        """Whether the JSON data of part was moved to the store"""
+        return self._call(self._get_meta, "imported_" + part) is not None
+
+    # Mod-log cases
+
+    def load_cases(self, server_id):
+        """Returns a server's cases, laid out like its JSON file"""
+        return self._call(self._load_cases, server_id)
+
+    def save_cases(self, server_id, counter, last_case, cases, *,
+                   replace=False):
+        """Writes the changed cases and the server's counter
+
+        With replace the server's other cases are deleted"""
+        rows = [self._case_row(server_id, case) for case in cases]
+        return self._write(self._save_cases, server_id, counter,
+                           json.dumps(last_case), rows, replace)
+
+    # Name and nickname history
+
+    def get_names(self, user_id):
+        """Returns an awaitable resolving to the names, oldest first"""
+        return self._fetch(self._get_history, "SELECT name FROM names WHERE "
+                           "user_id = ? ORDER BY id", (user_id,))
+
+    def get_nicknames(self, server_id, user_id):
+        """Returns an awaitable resolving to the nicknames, oldest first"""
+        return self._fetch(self._get_history, "SELECT nick FROM nicknames "
+                           "WHERE server_id = ? AND user_id = ? ORDER BY id",
+                           (server_id, user_id))
+
+    def add_name(self, user_id, name, limit):
+        """Records the name unless it's among the user's last limit ones"""
+        return self._write(self._add_history, "names", ("user_id",),
+                           (user_id,), "name", name, limit)
+
+    def add_nickname(self, server_id, user_id, nick, limit):
+        """Records the nickname unless it's among the last limit ones"""
+        return self._write(self._add_history, "nicknames",
+                           ("server_id", "user_id"), (server_id, user_id),
+                           "nick", nick, limit)
+
+    # Bank accounts
+
+    def load_accounts(self):
+        """Returns the accounts, laid out like bank.json"""
+        return self._call(self._load_accounts)
+
+    def apply_bank_ops(self, ops):
+        """Applies the operations of a bank journal record"""
+        rows = []
+        for op in ops:
+            if op[0] == "create":
+                account = op[3]
+                rows.append(("create", op[1], op[2], account["name"],
+                             account["balance"], account["created_at"]))
+            else:
+                rows.append(tuple(op))
+        return self._write(self._apply_bank_ops, rows)
+
+    # Migration
+
+    def import_mod(self, servers, past_names, past_nicknames):
+        """Imports cases and name history, in one transaction
+
+        servers maps server IDs to their cases' JSON data, the names
+        are laid out like past_names / past_nicknames.json"""
+        rows = []
+        meta = []
+        for server_id, data in servers.items():
+            meta.append((server_id, data["counter"],
+                         json.dumps(data["last_case"])))
+            rows.extend(self._case_row(server_id, case)
+                        for case in data["cases"].values())
+        names = [(user_id, name) for user_id, history in past_names.items()
+                 for name in history]
+        nicks = [(server_id, user_id, nick)
+                 for server_id, users in past_nicknames.items()
+                 for user_id, history in users.items()
+                 for nick in history]
+        return self._call(self._import_mod, meta, rows, names, nicks)
+
+    def import_bank(self, accounts):
+        """Imports bank.json's accounts, in one transaction"""
+        rows = []
+        legacy = []
+        for key, value in accounts.items():
+            if "balance" in value:  # Account from the old, serverless format
+                legacy.append((key, json.dumps(value)))
+                continue
+            rows.extend((key, user_id, a.get("name"), a["balance"],
+                         a.get("created_at"))
+                        for user_id, a in value.items())
+        return self._call(self._import_bank, rows, legacy)
+
+    # Thread side
+
+    def _call(self, func, *args):
+        return self._executor.submit(func, *args).result()
+
+    def _fetch(self, func, *args):
+        return asyncio.wrap_future(self._executor.submit(func, *args))
+
+    def _write(self, func, *args):
+        return self._executor.submit(self._logged, func, *args)
+
+    def _logged(self, func, *args):
+        try:
+            return func(*args)
+        except Exception:
+            self.logger.exception("SQLite write has failed")
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _get_meta(self, key):
+        row = self._connect().execute("SELECT value FROM meta WHERE key = ?",
+                                      (key,)).fetchone()
+        return row[0] if row else None
+
+    def _case_row(self, server_id, case):
+        return (server_id, case["case"], case["user_id"],
+                case["moderator_id"], case["action"], case.get("message"),
+                json.dumps(case))
+
+    def _load_cases(self, server_id):
+        conn = self._connect()
+        data = {"counter": 0, "last_case": {}, "cases": {}}
+        row = conn.execute("SELECT counter, last_case FROM case_servers "
+                           "WHERE server_id = ?", (server_id,)).fetchone()
+        if row is not None:
+            data["counter"] = row[0]
+            data["last_case"] = json.loads(row[1])
+        for case_n, case in conn.execute("SELECT case_n, data FROM cases "
+                                         "WHERE server_id = ?", (server_id,)):
+            data["cases"][str(case_n)] = json.loads(case)
+        return data
+
+    def _save_cases(self, server_id, counter, last_case, rows, replace):
+        conn = self._connect()
+        with conn:
+            if replace:
+                conn.execute("DELETE FROM cases WHERE server_id = ?",
+                             (server_id,))
+            conn.execute("INSERT OR REPLACE INTO case_servers (server_id, "
+                         "counter, last_case) VALUES (?, ?, ?)",
+                         (server_id, counter, last_case))
+            conn.executemany("INSERT OR REPLACE INTO cases (server_id, "
+                             "case_n, user_id, moderator_id, action, message, "
+                             "data) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def _get_history(self, query, params):
+        return [r[0] for r in self._connect().execute(query, params)]
+
+    def _add_history(self, table, key_columns, key, column, value, limit):
+        where = " AND ".join("{} = ?".format(c) for c in key_columns)
+        conn = self._connect()
+        with conn:
+            exists = conn.execute("SELECT 1 FROM {} WHERE {} AND {} = ?"
+                                  "".format(table, where, column),
+                                  key + (value,)).fetchone()
+            if exists:
+                return False
+            conn.execute("INSERT INTO {} ({}, {}) VALUES ({}?)"
+                         "".format(table, ", ".join(key_columns), column,
+                                   "?, " * len(key)),
+                         key + (value,))
+            conn.execute("DELETE FROM {0} WHERE {1} AND id NOT IN (SELECT id "
+                         "FROM {0} WHERE {1} ORDER BY id DESC LIMIT ?)"
+                         "".format(table, where), key + key + (limit,))
+        return True
+
+    def _load_accounts(self):
+        conn = self._connect()
+        accounts = {}
+        for user_id, data in conn.execute("SELECT user_id, data FROM "
+                                          "legacy_accounts"):
+            accounts[user_id] = json.loads(data)
+        for row in conn.execute("SELECT server_id, user_id, name, balance, "
+                                "created_at FROM accounts"):
+            accounts.setdefault(row[0], {})[row[1]] = {
+                "name": row[2],
+                "balance": row[3],
+                "created_at": row[4]
+            }
+        return accounts
+
+    def _apply_bank_ops(self, rows):
+        conn = self._connect()
+        with conn:
+            for row in rows:
+                if row[0] == "wipe":
+                    conn.execute("DELETE FROM accounts WHERE server_id = ?",
+                                 (row[1],))
+                elif row[0] == "create":
+                    conn.execute("INSERT OR REPLACE INTO accounts (server_id,"
+                                 " user_id, name, balance, created_at) "
+                                 "VALUES (?, ?, ?, ?, ?)", row[1:])
+                elif row[0] == "set":
+                    conn.execute("UPDATE accounts SET balance = ? WHERE "
+                                 "server_id = ? AND user_id = ?",
+                                 (row[3], row[1], row[2]))
+
+    def _import_mod(self, meta, rows, names, nicks):
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM case_servers")
+            conn.execute("DELETE FROM cases")
+            conn.execute("DELETE FROM names")
+            conn.execute("DELETE FROM nicknames")
+            conn.executemany("INSERT INTO case_servers (server_id, counter, "
+                             "last_case) VALUES (?, ?, ?)", meta)
+            conn.executemany("INSERT INTO cases (server_id, case_n, user_id, "
+                             "moderator_id, action, message, data) "
+                             "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            conn.executemany("INSERT INTO names (user_id, name) "
+                             "VALUES (?, ?)", names)
+            conn.executemany("INSERT INTO nicknames (server_id, user_id, "
+                             "nick) VALUES (?, ?, ?)", nicks)
+            self._set_imported(conn, "mod")
+
+    def _import_bank(self, rows, legacy):
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM accounts")
+            conn.execute("DELETE FROM legacy_accounts")
+            conn.executemany("INSERT INTO accounts (server_id, user_id, name,"
+                             " balance, created_at) VALUES (?, ?, ?, ?, ?)",
+                             rows)
+            conn.executemany("INSERT INTO legacy_accounts (user_id, data) "
+                             "VALUES (?, ?)", legacy)
+            self._set_imported(conn, "bank")
+
+    def _set_imported(self, conn, part):
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                     ("imported_" + part, "1"))
@@ -21,7 +21,7 @@ except ImportError:
 from cogs.utils.settings import Settings
 from cogs.utils.dataIO import dataIO
 from cogs.utils.chat_formatting import inline
-from collections import Counter
+from collections import Counter, namedtuple
 from io import TextIOWrapper
 
 #
@@ -39,24 +39,84 @@ from io import TextIOWrapper
 
 description = "Red - A multifunction Discord bot by Twentysix"
 
+MessageHandler = namedtuple("MessageHandler",
+                            "func commands_only server_only bots check")
+
+_UNSET = object()
+
+
+class MessageInfo:
+    """Facts about a message, computed once for all of its handlers
+
+    The costlier ones are only computed when first asked for"""
+
+    __slots__ = ("bot", "message", "is_private", "is_bot", "is_self",
+                 "prefix", "_server_settings", "_is_mod", "_allowed")
+
+    def __init__(self, bot, message):
+        self.bot = bot
+        self.message = message
+        self.is_private = message.channel.is_private
+        self.is_bot = message.author.bot
+        self.is_self = message.author == bot.user
+        self.prefix = bot.settings.get_message_prefix(message)
+        self._server_settings = _UNSET
+        self._is_mod = _UNSET
+        self._allowed = _UNSET
+
+    @property
+    def server_settings(self):
+        if self._server_settings is _UNSET:
+            self._server_settings = self.bot.settings.get_server(
+                self.message.server)
+        return self._server_settings
+
+    @property
+    def is_mod(self):
+        """Whether the author is the owner, an admin or a mod"""
+        if self._is_mod is _UNSET:
+            self._is_mod = self._check_mod()
+        return self._is_mod
+
+    @property
+    def allowed(self):
+        """Whether the author is allowed to use commands here"""
+        if self._allowed is _UNSET:
+            self._allowed = self.bot.user_allowed(self.message)
+        return self._allowed
+
+    def _check_mod(self):
+        author = self.message.author
+        if author.id == self.bot.settings.owner:
+            return True
+        if self.is_private or not isinstance(author, discord.Member):
+            return False
+        admin_ids, mod_ids = self.bot.settings.get_role_ids(
+            self.message.server)
+        return any(r.id in admin_ids or r.id in mod_ids
+                   for r in author.roles)
+
 
 class Bot(commands.Bot):
     def __init__(self, *args, **kwargs):
 
         def prefix_manager(bot, message):
             """
-            Returns prefixes of the message's server if set.
-            If none are set or if the message's server is None
-            it will return the global prefixes instead.
+            Returns the prefix the message starts with, out of the
+            server's prefixes if set, the global ones otherwise.
+            Returns an empty list if there is no match.
 
             Requires a Bot instance and a Message object to be
             passed as arguments.
             """
-            return bot.settings.get_prefixes(message.server)
+            prefix = bot.settings.get_message_prefix(message)
+            return [prefix] if prefix is not None else []
 
         self.counter = Counter()
         self.uptime = datetime.datetime.utcnow()  # Refreshed before login
         self._message_modifiers = []
+        self._message_handlers = []
+        self._cog_cache = {}
         self.settings = Settings()
         self._intro_displayed = False
         self._shutdown_mode = None
@@ -97,6 +157,7 @@ class Bot(commands.Bot):
         If restart is True, the exit code will be 26 instead
         The launcher automatically restarts Red when that happens"""
         self._shutdown_mode = not restart
+        dataIO.flush()
         await self.logout()
 
     def add_message_modifier(self, func):
@@ -130,6 +191,67 @@ class Bot(commands.Bot):
         """Removes all message modifiers from the bot"""
         self._message_modifiers.clear()
 
+    def add_message_handler(self, func, *, commands_only=False,
+                            server_only=False, bots=False, check=None):
+        """
+        Adds a message handler to the bot
+
+        A message handler is a coroutine function that accepts a
+        message and its MessageInfo. The filters are evaluated once
+        per message, before any handler runs:
+        commands_only: only messages starting with a prefix, from users
+                  allowed to use commands
+        server_only: skip private messages
+        bots: also receive messages from other bots
+        check: callable taking the message, the handler is skipped
+               if it returns False
+        The bot's own messages only reach commands_only handlers, when
+        running as a selfbot.
+        Handlers must be removed when their cog is unloaded.
+        """
+        if not asyncio.iscoroutinefunction(func):
+            raise TypeError("The message handler must be a coroutine "
+                            "function.")
+
+        self._message_handlers.append(
+            MessageHandler(func, commands_only, server_only, bots, check))
+
+    def remove_message_handler(self, func):
+        """Removes a message handler from the bot"""
+        for handler in self._message_handlers:
+            if handler.func == func:
+                self._message_handlers.remove(handler)
+                return
+        raise RuntimeError("Function not present in the message handlers.")
+
+    async def process_message(self, message):
+        """Runs the message through the handlers and the commands"""
+        info = MessageInfo(self, message)
+        for handler in self._message_handlers:
+            if self._handler_accepts(handler, info):
+                self.loop.create_task(
+                    self._run_message_handler(handler.func, message, info))
+        if info.prefix is not None and info.allowed:
+            await self.process_commands(message)
+
+    def _handler_accepts(self, handler, info):
+        if handler.server_only and info.is_private:
+            return False
+        if handler.commands_only:
+            if info.prefix is None or not info.allowed:
+                return False
+        elif info.is_self or (info.is_bot and not handler.bots):
+            return False
+        if handler.check is not None:
+            return handler.check(info.message)
+        return True
+
+    async def _run_message_handler(self, func, message, info):
+        try:
+            await func(message, info)
+        except Exception:
+            await self.on_error(func.__name__, message, info)
+
     async def send_cmd_help(self, ctx):
         if ctx.invoked_subcommand:
             pages = self.formatter.format_help_for(ctx, ctx.invoked_subcommand)
@@ -149,40 +271,53 @@ class Bot(commands.Bot):
         if author == self.user:
             return self.settings.self_bot
 
-        mod_cog = self.get_cog('Mod')
-        global_ignores = self.get_cog('Owner').global_ignores
+        mod_cog = self.get_cached_cog('Mod')
+        owner_cog = self.get_cached_cog('Owner')
 
         if self.settings.owner == author.id:
             return True
 
-        if author.id in global_ignores["blacklist"]:
-            return False
-
-        if global_ignores["whitelist"]:
-            if author.id not in global_ignores["whitelist"]:
+        if owner_cog is not None:
+            if author.id in owner_cog.blacklist_ids:
                 return False
 
+            if owner_cog.whitelist_ids:
+                if author.id not in owner_cog.whitelist_ids:
+                    return False
+
         if not message.channel.is_private:
-            server = message.server
-            names = (self.settings.get_server_admin(
-                server), self.settings.get_server_mod(server))
-            results = map(
-                lambda name: discord.utils.get(author.roles, name=name),
-                names)
-            for r in results:
-                if r is not None:
-                    return True
+            admin_ids, mod_ids = self.settings.get_role_ids(message.server)
+            if admin_ids or mod_ids:
+                for role in author.roles:
+                    if role.id in admin_ids or role.id in mod_ids:
+                        return True
 
         if mod_cog is not None:
             if not message.channel.is_private:
-                if message.server.id in mod_cog.ignore_list["SERVERS"]:
+                if message.server.id in mod_cog.ignored_servers:
                     return False
 
-                if message.channel.id in mod_cog.ignore_list["CHANNELS"]:
+                if message.channel.id in mod_cog.ignored_channels:
                     return False
 
         return True
 
+    def get_cached_cog(self, name):
+        """Like get_cog, remembered until cogs are added or removed"""
+        try:
+            return self._cog_cache[name]
+        except KeyError:
+            cog = self._cog_cache[name] = self.get_cog(name)
+            return cog
+
+    def add_cog(self, cog):
+        super().add_cog(cog)
+        self._cog_cache.clear()
+
+    def remove_cog(self, name):
+        super().remove_cog(name)
+        self._cog_cache.clear()
+
     async def pip_install(self, name, *, timeout=None):
         """
         Installs a pip package in the local 'lib' folder in a thread safe
@@ -339,11 +474,27 @@ def initialize(bot_class=Bot, formatter_class=Formatter):
     async def on_command(command, ctx):
         bot.counter["processed_commands"] += 1
 
+    @bot.event
+    async def on_server_role_create(role):
+        bot.settings.invalidate_role_ids(role.server)
+
+    @bot.event
+    async def on_server_role_delete(role):
+        bot.settings.invalidate_role_ids(role.server)
+
+    @bot.event
+    async def on_server_role_update(before, after):
+        if before.name != after.name:
+            bot.settings.invalidate_role_ids(after.server)
+
+    @bot.event
+    async def on_server_remove(server):
+        bot.settings.invalidate_role_ids(server)
+
     @bot.event
     async def on_message(message):
         bot.counter["messages_read"] += 1
-        if bot.user_allowed(message):
-            await bot.process_commands(message)
+        await bot.process_message(message)
 
     @bot.event
     async def on_command_error(error, ctx):
@@ -634,6 +785,7 @@ if __name__ == '__main__':
                              exc_info=e)
         loop.run_until_complete(bot.logout())
     finally:
+        dataIO.flush()
         loop.close()
         if bot._shutdown_mode is True:
             exit(0)
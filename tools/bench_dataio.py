@@ -0,0 +1,80 @@
+"""Compares DataIO's storage profiles on a synthetic bank
+
+Usage: python tools/bench_dataio.py [accounts] [servers]
+
+Saves and loads a bank.json shaped file of 100k accounts over 50
+servers (by default) with the pretty and compact profiles. The compact
+profile is measured with every json backend that can be imported."""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cogs.utils import dataIO as dataIO_module
+from cogs.utils.dataIO import DataIO
+
+
+def make_bank(accounts, servers):
+    bank = {}
+    per_server = accounts // servers
+    user_id = 96130341705637888
+    for s in range(servers):
+        server = bank[str(133049272517001216 + s)] = {}
+        for _ in range(per_server):
+            user_id += 7919
+            server[str(user_id)] = {
+                "name": "User {}".format(user_id % 100000),
+                "balance": user_id % 1000000,
+                "created_at": "2017-03-14 15:09:26"
+            }
+    return bank
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def bench(label, profile, bank, directory):
+    io = DataIO()
+    path = os.path.join(directory, "bank-{}.json".format(label))
+    io.set_profile(path, profile)
+    save, _ = timed(io.save_json, path, bank)
+    load, loaded = timed(io._read_json, path)
+    assert loaded == bank
+    size = os.path.getsize(path) / 1024 / 1024
+    print("  {:<18} save {:.2f}s  load {:.2f}s  {:.1f} MB"
+          "".format(label, save, load, size))
+
+
+def main():
+    accounts = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    servers = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    bank = make_bank(accounts, servers)
+    print("Synthetic bank of {} accounts over {} servers:"
+          "".format(accounts, servers))
+
+    backends = [("orjson", dataIO_module.orjson),
+                ("ujson", dataIO_module.ujson),
+                ("json", None)]
+    saved = dataIO_module.orjson, dataIO_module.ujson
+    with tempfile.TemporaryDirectory() as directory:
+        bench("pretty", "pretty", bank, directory)
+        for name, module in backends:
+            if name != "json" and module is None:
+                continue
+            # _dumps / _loads pick the first backend that isn't None
+            dataIO_module.orjson = module if name == "orjson" else None
+            dataIO_module.ujson = module if name == "ujson" else None
+            try:
+                bench("compact ({})".format(name), "compact", bank, directory)
+            finally:
+                dataIO_module.orjson, dataIO_module.ujson = saved
+
+
+if __name__ == "__main__":
+    main()